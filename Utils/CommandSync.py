@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+from typing import TYPE_CHECKING, Optional
+
+import discord
+import orjson
+
+if TYPE_CHECKING:
+    from bot import CritBot
+
+
+GLOBAL_SCOPE = 0  # the scope of the global commands in `command_sync_hashes`, guilds use their id
+
+
+class CommandSync:
+    """Syncs the application commands only when they changed since the last sync of their scope (global or a guild).
+
+    The hash of the payload discord.py would upload, translations included, is kept per scope in `command_sync_hashes`.
+    Syncs requested with `request` go through a queue that syncs one scope at a time, waiting `interval` seconds between uploads
+    and longer when Discord rate limits them.
+    """
+
+    __slots__ = ("bot", "interval", "hashes", "lock", "pending", "worker")
+
+    def __init__(self, bot: "CritBot", interval: float = 2.0) -> None:
+        self.bot = bot
+        self.interval = interval  # seconds between two uploads of the queue
+        self.hashes: Optional[dict[int, str]] = None  # scope: hash of the last synced payload, loaded on first use
+        self.lock = asyncio.Lock()
+        self.pending: dict[int, Optional[discord.abc.Snowflake]] = {}  # scope: guild, in the order they were requested
+        self.worker: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def scope(guild: Optional[discord.abc.Snowflake]) -> int:
+        return GLOBAL_SCOPE if guild is None else guild.id
+
+    async def payload_hash(self, guild: Optional[discord.abc.Snowflake] = None) -> str:
+        """The hash of the commands payload of a scope, built the same way `CommandTree.sync` builds it."""
+        tree = self.bot.tree
+        commands = tree._get_all_commands(guild=guild)
+        translator = tree.translator
+        if translator:
+            payload = [await command.get_translated_payload(tree, translator) for command in commands]
+        else:
+            payload = [command.to_dict(tree) for command in commands]
+
+        # the order of the commands in the tree doesn't change what Discord ends up with
+        payload.sort(key=lambda command: (command.get("type", 1), command["name"]))
+        return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    async def sync(
+        self, guild: Optional[discord.abc.Snowflake] = None, *, force: bool = False
+    ) -> bool:
+        """Sync the commands of a scope if they changed since its last sync.
+
+        Args:
+            guild (Optional[discord.abc.Snowflake], optional): The guild to sync, None for the global commands. Defaults to None.
+            force (bool, optional): Sync even if nothing changed. Defaults to False.
+
+        Raises:
+            app_commands.CommandSyncFailure: If Discord rejected the commands.
+            discord.HTTPException: If the upload failed.
+
+        Returns:
+            bool: Whether the commands were uploaded.
+        """
+        scope = self.scope(guild)
+        async with self.lock:
+            if self.hashes is None:
+                self.hashes = await self.load()
+
+            digest = await self.payload_hash(guild)
+            if not force and self.hashes.get(scope) == digest:
+                return False
+
+            await self.bot.tree.sync(guild=guild)
+            self.hashes[scope] = digest
+            async with self.bot.db_pool.acquire() as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO command_sync_hashes (scope, hash) VALUES ($1, $2)
+                    ON CONFLICT (scope) DO UPDATE SET hash = excluded.hash, synced_at = now();
+                    """,
+                    scope,
+                    digest,
+                )
+
+        self.bot.logger.log(20, f"Synced the commands of {guild.id if guild else 'global'}")
+        return True
+
+    def request(self, guild: Optional[discord.abc.Snowflake] = None) -> None:
+        """Queue a sync of a scope, a scope that is already queued isn't queued twice."""
+        self.pending[self.scope(guild)] = guild
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.get_running_loop().create_task(self.work())
+
+    async def work(self) -> None:
+        while self.pending:
+            scope = next(iter(self.pending))
+            guild = self.pending.pop(scope)
+            try:
+                synced = await self.sync(guild)
+            except discord.RateLimited as e:
+                # back in line, after everything else that was requested
+                self.pending.setdefault(scope, guild)
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                # HTTP errors, the database, a broken translation, ... the other scopes still get synced
+                self.bot.logger.log(40, f"Failed to sync the commands of {scope}: {e!r}")
+                synced = True
+
+            if synced:
+                await asyncio.sleep(self.interval)
+
+    async def forget(self, guild: discord.abc.Snowflake) -> None:
+        """Drop the hash of a guild, e.g. when the bot leaves it, so its commands are synced again if it comes back."""
+        self.pending.pop(guild.id, None)
+        if self.hashes is not None:
+            self.hashes.pop(guild.id, None)
+        async with self.bot.db_pool.acquire() as conn:
+            await conn.execute("DELETE FROM command_sync_hashes WHERE scope = $1;", guild.id)
+
+    async def load(self) -> dict[int, str]:
+        async with self.bot.db_pool.acquire() as conn:
+            records = await conn.fetch("SELECT scope, hash FROM command_sync_hashes;")
+        return {record["scope"]: record["hash"] for record in records}
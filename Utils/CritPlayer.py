@@ -0,0 +1,402 @@
+import asyncio
+from dataclasses import dataclass
+from itertools import accumulate
+from typing import Any, ClassVar, Iterable, Optional, SupportsIndex
+
+import aiohttp
+import discord
+import wavelink
+from discord.ext import commands
+from discord.utils import MISSING
+
+from .WavelinkInternals import detach_player
+
+
+@dataclass(slots=True, eq=False)
+class PlaylistEntry:
+    """Lightweight placeholder for a playlist track that wasn't decoded into a wavelink.Playable yet.
+
+    Only keeps what the queue needs to be listed and timed, the rest is decoded by Lavalink from `encoded`
+    when the entry gets close to being played (see `CritPlayer.resolve_ahead`).
+    """
+
+    encoded: str
+    title: str
+    length: int
+    is_stream: bool
+    source: str
+    ctx: Optional[commands.Context] = None
+
+    first_playing: ClassVar[bool] = False
+
+    @classmethod
+    def from_playable(
+        cls, track: wavelink.Playable, ctx: Optional[commands.Context] = None
+    ) -> "PlaylistEntry":
+        return cls(
+            encoded=track.encoded,
+            title=track.title,
+            length=track.length,
+            is_stream=track.is_stream,
+            source=track.source,
+            ctx=ctx,
+        )
+
+    @classmethod
+    def from_data(
+        cls, data: dict[str, Any], ctx: Optional[commands.Context] = None
+    ) -> "PlaylistEntry":
+        """From a raw Lavalink track (as in /v4/loadtracks and /v4/decodetracks), without building a wavelink.Playable."""
+        info = data["info"]
+        return cls(
+            encoded=data["encoded"],
+            title=info["title"],
+            length=info["length"],
+            is_stream=info["isStream"],
+            source=info["sourceName"],
+            ctx=ctx,
+        )
+
+
+class CritQueue(wavelink.Queue):
+    """wavelink.Queue that keeps a prefix sum of the track lengths, so the time until any position is O(1).
+
+    Appending and getting from the front update the index in place, any other change marks it dirty
+    and it is rebuilt once (O(n)) the next time it's needed. Live streams count as zero length.
+    """
+
+    def __init__(self, *, history: bool = True) -> None:
+        super().__init__(history=history)
+        # _prefix[self._head + i] - _prefix[self._head] is the length of the first i tracks
+        self._prefix: list[int] = [0]
+        self._head = 0
+        self._dirty = False
+
+    @staticmethod
+    def _track_length(track: wavelink.Playable | PlaylistEntry) -> int:
+        return 0 if track.is_stream else track.length
+
+    @staticmethod
+    def _check_compatibility(item: Any) -> bool:
+        # a staticmethod like wavelink's, `Queue._check_atomic` calls it on the class
+        if not isinstance(item, PlaylistEntry):
+            wavelink.Queue._check_compatibility(item)
+        return True
+
+    def replace_entry(self, entry: PlaylistEntry, track: wavelink.Playable | None) -> bool:
+        """Swap a placeholder for its decoded track, or drop it if `track` is None.
+
+        The entry is looked up by identity since it may have moved while it was being resolved.
+
+        Returns:
+            bool: Whether the entry was still in the queue.
+        """
+        for index, item in enumerate(self._items):
+            if item is entry:
+                break
+        else:
+            return False
+
+        if track is None:
+            del self._items[index]
+            self._dirty = True
+        else:
+            self._items[index] = track
+            if self._track_length(track) != self._track_length(entry):
+                self._dirty = True
+        return True
+
+    def _rebuild(self) -> None:
+        self._prefix = [0, *accumulate(map(self._track_length, self._items))]
+        self._head = 0
+        self._dirty = False
+
+    def _ensure_index(self) -> None:
+        # the length check catches any change made behind our back (e.g. directly on `_items`)
+        if self._dirty or len(self._prefix) - 1 - self._head != len(self._items):
+            self._rebuild()
+
+    def _index_appended(self, count: int) -> None:
+        if self._dirty or count <= 0:
+            return
+        for track in self._items[-count:]:
+            self._prefix.append(self._prefix[-1] + self._track_length(track))
+
+    def _index_popped_front(self) -> None:
+        self._head += 1
+        if self._head > 1024 and self._head * 2 > len(self._prefix):
+            # drop the consumed part of the index so it doesn't grow forever
+            consumed = self._prefix[self._head]
+            self._prefix = [value - consumed for value in self._prefix[self._head :]]
+            self._head = 0
+
+    def time_until(self, index: int) -> int:
+        """The sum of the lengths (in milliseconds) of the tracks before `index`."""
+        self._ensure_index()
+        index = min(max(index, 0), len(self._items))
+        return self._prefix[self._head + index] - self._prefix[self._head]
+
+    @property
+    def total_length(self) -> int:
+        """The sum of the lengths (in milliseconds) of every track in the queue."""
+        return self.time_until(len(self._items))
+
+    def get(self) -> wavelink.Playable:
+        before = len(self._items)
+        track = super().get()
+        after = len(self._items)
+
+        if after == before - 1 and not self._dirty:
+            self._index_popped_front()
+        elif after != before:  # loop_all refilled the queue from the history
+            self._dirty = True
+        return track
+
+    def get_at(self, index: int, /) -> wavelink.Playable:
+        track = super().get_at(index)
+        self._dirty = True
+        return track
+
+    def put(self, item, /, *, atomic: bool = True) -> int:
+        added = super().put(item, atomic=atomic)
+        self._index_appended(added)
+        return added
+
+    async def put_wait(self, item, /, *, atomic: bool = True) -> int:
+        # the non atomic path yields between tracks, so other changes can interleave
+        added = await super().put_wait(item, atomic=atomic)
+        self._dirty = True
+        return added
+
+    def put_at(self, index: int, value: wavelink.Playable, /) -> None:
+        super().put_at(index, value)
+        self._dirty = True
+
+    def put_many_at(
+        self, index: int, tracks: Iterable[wavelink.Playable | PlaylistEntry], /
+    ) -> int:
+        """Insert every track at the given index in a single splice, like `put_at` for many tracks.
+
+        Args:
+            index (int): The index to put the tracks at.
+            tracks (Iterable[wavelink.Playable | PlaylistEntry]): The tracks, a wavelink.Playlist works too.
+
+        Raises:
+            TypeError: If any of the tracks is not a wavelink.Playable or a PlaylistEntry, in which case none are added.
+
+        Returns:
+            int: The number of tracks added to the queue.
+        """
+        tracks = list(tracks)
+        self._check_atomic(tracks)
+
+        appending = index >= len(self._items)
+        self._items[index:index] = tracks
+
+        if appending:
+            self._index_appended(len(tracks))
+        else:
+            self._dirty = True
+
+        self._wakeup_next()
+        return len(tracks)
+
+    def __setitem__(self, index: SupportsIndex, value: wavelink.Playable, /) -> None:
+        super().__setitem__(index, value)
+        self._dirty = True
+
+    def __delitem__(self, index: int | slice, /) -> None:
+        super().__delitem__(index)
+        self._dirty = True
+
+    def delete(self, index: int, /) -> None:
+        super().delete(index)
+        self._dirty = True
+
+    def remove(self, item: wavelink.Playable, /, count: int | None = 1) -> int:
+        removed = super().remove(item, count)
+        self._dirty = True
+        return removed
+
+    def shuffle(self) -> None:
+        super().shuffle()
+        self._dirty = True
+
+    def clear(self) -> None:
+        super().clear()
+        self._prefix = [0]
+        self._head = 0
+        self._dirty = False
+
+
+class CritPlayer(wavelink.Player):
+    """wavelink.Player with the per guild state used by the music cog."""
+
+    look_ahead = 5  # how many of the next entries are kept decoded
+    resolve_attempts = 3
+    retry_delay = 10  # seconds before playing again an entry that couldn't be decoded
+
+    def __init__(
+        self,
+        client: discord.Client = MISSING,
+        channel: discord.abc.Connectable = MISSING,
+        *,
+        nodes: Optional[list[wavelink.Node]] = None,
+    ) -> None:
+        if nodes is None and (lavalink_nodes := getattr(client, "lavalink_nodes", None)):
+            # the least loaded node instead of wavelink's default of the one with the fewest players
+            nodes = [lavalink_nodes.best_node()]
+
+        super().__init__(client, channel, nodes=nodes)
+        self.ctx: Optional[commands.Context] = None
+        self.queue: CritQueue = CritQueue()
+
+        # track.encoded: task getting the info for the "now playing" embed of an upcoming track
+        self.prefetches: dict[str, asyncio.Task] = {}
+        self.resolve_lock = asyncio.Lock()
+        self.retry_task: Optional[asyncio.Task] = None
+
+    @property
+    def needs_resolving(self) -> bool:
+        """Whether any of the next `look_ahead` queue entries is still a placeholder."""
+        return any(
+            isinstance(track, PlaylistEntry)
+            for track in self.queue[: self.look_ahead]
+        )
+
+    async def resolve(self, entry: PlaylistEntry) -> wavelink.Playable | None:
+        """Decode a placeholder into a wavelink.Playable, retrying with a backoff if Lavalink can't be reached.
+
+        Args:
+            entry (PlaylistEntry): The placeholder.
+
+        Raises:
+            wavelink.NodeException | aiohttp.ClientError | asyncio.TimeoutError: If every attempt failed.
+
+        Returns:
+            wavelink.Playable | None: The track, None if Lavalink rejected it (a dead entry).
+        """
+        for attempt in range(self.resolve_attempts):
+            try:
+                data = await self.node.send(
+                    "GET",
+                    path="v4/decodetrack",
+                    params={"encodedTrack": entry.encoded},
+                )
+                break
+            except wavelink.LavalinkException as e:
+                # Lavalink answered, so the entry itself is broken and retrying won't help
+                self.client.logger.log(
+                    30, f"Skipping the dead playlist entry {entry.title!r}: {e}"
+                )
+                return None
+            except (
+                wavelink.NodeException,
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+            ) as e:
+                if attempt == self.resolve_attempts - 1:
+                    raise
+                self.client.logger.log(
+                    30,
+                    f"Failed to decode {entry.title!r} (attempt {attempt + 1}/{self.resolve_attempts}): {e!r}",
+                )
+                await asyncio.sleep(2**attempt)
+
+        track = wavelink.Playable(data)
+        track.ctx = entry.ctx
+        track.first_playing = False
+        return track
+
+    async def resolve_ahead(self) -> None:
+        """Decode the placeholders among the next `look_ahead` queue entries in place, dead ones are removed.
+
+        Runs until the look-ahead window is fully decoded, so entries that shift into it while resolving are handled too.
+        Entries that failed because Lavalink couldn't be reached are kept and retried on the next call.
+        """
+        if self.resolve_lock.locked():
+            return
+
+        async with self.resolve_lock:
+            while entries := [
+                track
+                for track in self.queue[: self.look_ahead]
+                if isinstance(track, PlaylistEntry)
+            ]:
+                results = await asyncio.gather(
+                    *map(self.resolve, entries), return_exceptions=True
+                )
+
+                failed = False
+                for entry, result in zip(entries, results):
+                    if isinstance(result, BaseException):
+                        failed = True
+                    else:
+                        self.queue.replace_entry(entry, result)
+
+                if failed:
+                    return
+
+    async def play(
+        self, track: wavelink.Playable | PlaylistEntry, **kwargs
+    ) -> wavelink.Playable | None:
+        """Same as wavelink.Player.play, but placeholders that reached the front before being resolved are decoded first.
+        Dead placeholders are skipped in favour of the next track in the queue.
+        Tracks decoded here are marked `resolved_late`, nothing announced them when the previous one ended.
+
+        A placeholder that can't be decoded because Lavalink can't be reached goes back to the front of the queue
+        and is played again after `retry_delay` seconds, in which case this returns None.
+        """
+        while isinstance(track, PlaylistEntry):
+            try:
+                resolved = await self.resolve(track)
+            except (
+                wavelink.NodeException,
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+            ) as e:
+                # the callers (track end, autoplay) run this in a task, raising would drop the entry and stop the playback
+                self.queue.put_at(0, track)
+                self.client.logger.log(
+                    40,
+                    f"Failed to decode {track.title!r}, playing it again in {self.retry_delay}s: {e!r}",
+                )
+                if self.retry_task is None or self.retry_task.done():
+                    self.retry_task = asyncio.get_running_loop().create_task(
+                        self.retry_play()
+                    )
+                return None
+
+            if resolved is not None:
+                resolved.resolved_late = True
+                track = resolved
+            elif self.queue:
+                track = self.queue.get()
+            else:
+                raise wavelink.QueueEmpty("Every remaining playlist entry is dead")
+
+        return await super().play(track, **kwargs)
+
+    async def retry_play(self) -> None:
+        await asyncio.sleep(self.retry_delay)
+        # something else may have started playing or the player left in the meantime
+        if self.connected and not self.playing and self.queue:
+            await self.play(self.queue.get())
+
+    def detach(self) -> bool:
+        """Forget the player without destroying it on Lavalink or leaving the voice channel, for a planned shutdown.
+
+        `Client.close` disconnects every voice client, which would DELETE the player on Lavalink.
+        A detached player keeps playing on Lavalink while its session can be resumed (the node's resume timeout),
+        and the restarted bot takes it back over from the saved session id.
+
+        Returns:
+            bool: Whether it was detached, see `detach_player`.
+        """
+        return detach_player(self)
+
+    @property
+    def playback_speed(self) -> float:
+        """How fast the audio is being played because of the timescale filter, e.g. 1.2 with nightcore."""
+        timescale = self.filters.timescale.payload
+        return timescale.get("speed", 1.0) * timescale.get("rate", 1.0)
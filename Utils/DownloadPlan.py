@@ -0,0 +1,123 @@
+from dataclasses import dataclass
+from typing import Any, Optional
+
+# standard bitrates (kbps) tried from the best down, mp3 is used while it sounds good and opus below that
+MP3_BITRATES = (320, 256, 224, 192, 160, 128)
+OPUS_BITRATES = (112, 96, 80, 64, 56, 48, 40, 32, 24)
+
+# codec of an audio only format: the extension it's saved with when it's copied without re-encoding
+COPYABLE_CODECS = {"opus": "opus", "mp4a": "m4a"}
+
+# ffmpeg (encoder, muxer) used for each output codec when transcoding into a pipe
+ENCODERS = {"mp3": ("libmp3lame", "mp3"), "opus": ("libopus", "opus")}
+
+# room left for the container overhead and bitrate fluctuations
+SIZE_MARGIN = 0.95
+
+
+@dataclass(slots=True, frozen=True)
+class DownloadPlan:
+    codec: str  # the output codec, also the file extension
+    bitrate: int  # in kbps
+    expected_size: int  # in bytes
+    format: Optional[dict[str, Any]] = None  # the audio only format that is copied as is, None when transcoding
+
+    @property
+    def copy(self) -> bool:
+        return self.format is not None
+
+    @property
+    def quality(self) -> str:
+        """Identifies the output for the transcode cache, copies of different formats aren't the same file."""
+        if self.format is not None:
+            return f"copy-{self.format['format_id']}"
+        return str(self.bitrate)
+
+    @property
+    def ytdlp_overrides(self) -> dict[str, Any]:
+        """YoutubeDL options that download the right format and convert it to this plan's output."""
+        postprocessor = {"key": "FFmpegExtractAudio", "preferredcodec": self.codec}
+        if self.format is not None:
+            # FFmpegExtractAudio copies the audio when the preferred codec is the one of the file
+            return {"format": self.format["format_id"], "postprocessors": [postprocessor]}
+
+        postprocessor["preferredquality"] = str(self.bitrate)
+        return {"format": "bestaudio/best", "postprocessors": [postprocessor]}
+
+    def ffmpeg_args(self) -> list[str]:
+        """ffmpeg output arguments that write this plan's output to a pipe."""
+        if self.format is not None:
+            return ["-vn", "-c:a", "copy", "-f", self.codec]
+
+        encoder, muxer = ENCODERS[self.codec]
+        return ["-vn", "-c:a", encoder, "-b:a", f"{self.bitrate}k", "-f", muxer]
+
+
+def _format_size(fmt: dict[str, Any], duration: float) -> Optional[int]:
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if size:
+        return int(size)
+
+    bitrate = fmt.get("abr") or fmt.get("tbr")
+    if bitrate:
+        return int(bitrate * 1000 / 8 * duration)
+    return None
+
+
+def _copyable_codec(fmt: dict[str, Any]) -> Optional[str]:
+    if fmt.get("vcodec") not in (None, "none") or not fmt.get("acodec"):
+        return None
+    return COPYABLE_CODECS.get(fmt["acodec"].split(".")[0])
+
+
+def plan_download(
+    info: dict[str, Any],
+    max_size: int,
+    max_bitrate: int = 320,
+    seekable: bool = True,
+) -> Optional[DownloadPlan]:
+    """Pick how to download a track so it fits in `max_size` bytes with the best quality possible.
+
+    An audio only format that already fits is copied without re-encoding, the one with the highest bitrate wins.
+    Otherwise the track is transcoded at the highest standard bitrate that fits, to mp3 if that is at least 128kbps and to opus below that.
+
+    Args:
+        info (dict[str, Any]): The track info extracted by yt-dlp.
+        max_size (int): The biggest the file can be in bytes, e.g. the Discord upload limit.
+        max_bitrate (int, optional): The highest bitrate to transcode to in kbps. Defaults to 320.
+        seekable (bool, optional): Whether the output is a file, m4a can't be written to a pipe. Defaults to True.
+
+    Returns:
+        Optional[DownloadPlan]: The plan, None if the track has no known duration or is too long to fit even at the lowest bitrate.
+    """
+    duration = info.get("duration")
+    if not duration:
+        return None
+
+    budget = max_size * SIZE_MARGIN
+
+    best: Optional[DownloadPlan] = None
+    for fmt in info.get("formats") or ():
+        codec = _copyable_codec(fmt)
+        if codec is None or (codec == "m4a" and not seekable):
+            continue
+
+        size = _format_size(fmt, duration)
+        if size is None or size > budget:
+            continue
+
+        bitrate = int(fmt.get("abr") or fmt.get("tbr") or size * 8 / 1000 / duration)
+        if best is None or bitrate > best.bitrate:
+            best = DownloadPlan(codec, bitrate, size, fmt)
+
+    if best is not None:
+        return best
+
+    # bytes per second * 8 / 1000 = kbps
+    available = min(budget * 8 / 1000 / duration, max_bitrate)
+    for codec, bitrates in (("mp3", MP3_BITRATES), ("opus", OPUS_BITRATES)):
+        for bitrate in bitrates:
+            if bitrate <= available:
+                return DownloadPlan(codec, bitrate, int(bitrate * 1000 / 8 * duration))
+
+    return None
@@ -0,0 +1,132 @@
+import asyncio
+import os
+from collections import deque
+from typing import Optional
+
+
+class DownloadWorkspaceFull(Exception):
+    pass
+
+
+class DownloadReservation:
+    """Bytes of the workspace budget held by one download until `release` is called."""
+
+    __slots__ = ("workspace", "size", "released")
+
+    def __init__(self, workspace: "DownloadWorkspace", size: int) -> None:
+        self.workspace = workspace
+        self.size = size
+        self.released = False
+
+    def release(self) -> None:
+        """Gives the bytes back to the workspace, calling it more than once does nothing."""
+        if not self.released:
+            self.released = True
+            self.workspace._release(self.size)
+
+    def __enter__(self) -> "DownloadReservation":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.release()
+
+
+class DownloadWorkspace:
+    """Directory owned by the downloads plus an in-process ledger of the bytes reserved in it.
+
+    Every download reserves its expected size before starting and releases it once the file is sent (or it failed),
+    so admission only compares two counters instead of measuring the directory.
+    Downloads that don't fit wait in a FIFO and are admitted in order as space is released.
+    With `in_memory` the downloads are transcoded into memory instead, and the budget limits the memory held by them.
+    """
+
+    __slots__ = ("path", "budget", "in_memory", "used", "waiters")
+
+    def __init__(
+        self,
+        path: str = "/tmp/critbot-downloads",
+        budget: int = 1024 * 1024 * 1024,
+        in_memory: bool = False,
+    ) -> None:
+        self.path = path
+        self.budget = budget  # in bytes
+        self.in_memory = in_memory
+        self.used = 0
+        self.waiters: deque[tuple[int, asyncio.Future]] = deque()
+
+        os.makedirs(self.path, exist_ok=True)
+
+    @property
+    def available(self) -> int:
+        return self.budget - self.used
+
+    def reserve_nowait(self, size: int) -> Optional[DownloadReservation]:
+        """Reserve `size` bytes if they are available and nobody is waiting before us.
+
+        Returns:
+            Optional[DownloadReservation]: The reservation, None if the download would have to wait.
+        """
+        size = min(size, self.budget)  # a download bigger than the budget waits for an empty workspace
+        if self.waiters or size > self.available:
+            return None
+
+        self.used += size
+        return DownloadReservation(self, size)
+
+    async def reserve(
+        self, size: int, timeout: Optional[float] = None
+    ) -> DownloadReservation:
+        """Reserve `size` bytes, waiting in line until they are available.
+
+        Args:
+            size (int): The expected size of the download in bytes.
+            timeout (Optional[float], optional): How long to wait in line in seconds. Defaults to None (forever).
+
+        Raises:
+            DownloadWorkspaceFull: If the bytes weren't available in time.
+
+        Returns:
+            DownloadReservation: The reservation, release it once the file is gone.
+        """
+        if (reservation := self.reserve_nowait(size)) is not None:
+            return reservation
+
+        size = min(size, self.budget)
+        future: asyncio.Future[DownloadReservation] = (
+            asyncio.get_running_loop().create_future()
+        )
+        waiter = (size, future)
+        self.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # admitted right as we gave up
+                future.result().release()
+            else:
+                future.cancel()
+                self.waiters.remove(waiter)
+                # we may have been the one blocking the line
+                self._wake()
+
+            if isinstance(e, asyncio.TimeoutError):
+                raise DownloadWorkspaceFull(
+                    f"{size} bytes weren't available in {timeout} seconds"
+                ) from None
+            raise
+
+    def position(self, size: int) -> int:
+        """How many downloads are waiting in line, i.e. the position a new reservation of `size` bytes would get (0 if it fits now)."""
+        if not self.waiters and size <= self.available:
+            return 0
+        return len(self.waiters) + 1
+
+    def _release(self, size: int) -> None:
+        self.used -= size
+        self._wake()
+
+    def _wake(self) -> None:
+        while self.waiters and self.waiters[0][0] <= self.available:
+            size, future = self.waiters.popleft()
+            self.used += size
+            future.set_result(DownloadReservation(self, size))
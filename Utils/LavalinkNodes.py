@@ -0,0 +1,228 @@
+import asyncio
+import re
+import time
+from typing import TYPE_CHECKING, Any, Optional
+
+import wavelink
+
+from .WavelinkInternals import check_version, move_player
+
+if TYPE_CHECKING:
+    from bot import CritBot
+
+_SESSION = re.compile(r"sessions/[^/]+")
+_PLAYER = re.compile(r"players/\d+")
+
+
+class CritNode(wavelink.Node):
+    """wavelink.Node that times its REST requests for the bot's metrics, labelled by endpoint so ids don't become labels."""
+
+    async def send(
+        self,
+        method: str = "GET",
+        *,
+        path: str,
+        data: Any | None = None,
+        params: dict[str, Any] | None = None,
+    ) -> Any:
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await super().send(method, path=path, data=data, params=params)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            if (metrics := getattr(self.client, "metrics", None)) is not None:
+                endpoint = _PLAYER.sub("players/{guild}", _SESSION.sub("sessions/{session}", path))
+                metrics.observe(
+                    "critbot_lavalink_request_seconds",
+                    time.perf_counter() - start,
+                    node=self.identifier,
+                    method=method,
+                    endpoint=endpoint,
+                    outcome=outcome,
+                )
+
+
+def node_penalty(stats: wavelink.StatsResponsePayload) -> float:
+    """The load of a node, the same formula Lavalink clients use to balance players (lower is better).
+
+    Playing players count once each, the CPU and the frame deficit grow exponentially so a node close to its limit
+    is avoided long before it has the most players.
+    """
+    penalty = stats.playing + 1.05 ** (100 * stats.cpu.system_load) * 10 - 10
+
+    if stats.frames is not None:
+        # per player frames per minute, 3000 is a full minute of 20ms frames
+        deficit = 1.03 ** (500 * (stats.frames.deficit / 3000)) * 600 - 600
+        nulled = (1.03 ** (500 * (stats.frames.nulled / 3000)) * 300 - 300) * 2
+        penalty += deficit + nulled
+
+    return penalty
+
+
+class LavalinkNodes:
+    """The Lavalink nodes of the bot.
+
+    New players go to the connected node with the lowest penalty (see `node_penalty`), using the stats polled every `stats_interval` seconds.
+    The players of a node that stays disconnected for `failover_after` seconds are moved to another node, at the same track position.
+    They are remembered as soon as the node goes down, wavelink forgets them once it gives up reconnecting to it.
+    """
+
+    __slots__ = (
+        "bot",
+        "nodes",
+        "penalties",
+        "down_since",
+        "stranded",
+        "stats_interval",
+        "failover_after",
+        "monitor_task",
+    )
+
+    def __init__(
+        self,
+        bot: "CritBot",
+        nodes: list[wavelink.Node],
+        stats_interval: float = 30,
+        failover_after: float = 15,
+    ) -> None:
+        self.bot = bot
+        self.nodes = nodes
+        self.penalties: dict[str, float] = {}  # node identifier: penalty
+        self.down_since: dict[str, float] = {}  # node identifier: monotonic time it was first seen disconnected
+        self.stranded: dict[str, list[wavelink.Player]] = {}  # node identifier: its players when it went down
+        self.stats_interval = stats_interval
+        self.failover_after = failover_after
+        self.monitor_task: Optional[asyncio.Task] = None
+
+        check_version(self.bot.logger)
+
+    @property
+    def connected(self) -> list[wavelink.Node]:
+        return [
+            node for node in self.nodes if node.status is wavelink.NodeStatus.CONNECTED
+        ]
+
+    def best_node(self, exclude: Optional[wavelink.Node] = None) -> wavelink.Node:
+        """The connected node with the lowest penalty.
+
+        Nodes without stats yet are ranked by their number of players, like wavelink does.
+
+        Raises:
+            wavelink.InvalidNodeException: If no node is connected.
+        """
+        nodes = [node for node in self.connected if node is not exclude]
+        if not nodes:
+            raise wavelink.InvalidNodeException("No Lavalink node is connected.")
+
+        return min(
+            nodes,
+            key=lambda node: self.penalties.get(node.identifier, len(node.players)),
+        )
+
+    def start(self) -> None:
+        self.monitor_task = self.bot.create_task(self.monitor())
+
+    async def monitor(self) -> None:
+        interval = min(self.stats_interval, self.failover_after / 3)
+        last_stats = 0.0
+        while True:
+            now = time.monotonic()
+            if now - last_stats >= self.stats_interval:
+                last_stats = now
+                await self.refresh_stats()
+
+            for node in self.nodes:
+                if node.status is wavelink.NodeStatus.CONNECTED:
+                    self.down_since.pop(node.identifier, None)
+                    self.stranded.pop(node.identifier, None)
+                    continue
+
+                if node.identifier not in self.down_since:
+                    self.down_since[node.identifier] = now
+                    # `Node.players` is emptied when wavelink stops trying to reconnect
+                    self.stranded[node.identifier] = list(node.players.values())
+
+                if (
+                    self.stranded.get(node.identifier) or node.players
+                ) and now - self.down_since[node.identifier] >= self.failover_after:
+                    await self.failover(node)
+
+            await asyncio.sleep(interval)
+
+    async def refresh_stats(self) -> None:
+        nodes = self.connected
+        results = await asyncio.gather(
+            *(node.fetch_stats() for node in nodes), return_exceptions=True
+        )
+        for node, stats in zip(nodes, results):
+            if isinstance(stats, BaseException):
+                self.penalties.pop(node.identifier, None)
+            else:
+                self.penalties[node.identifier] = node_penalty(stats)
+
+    async def failover(self, node: wavelink.Node) -> None:
+        """Move every player of a dead node to the best surviving one."""
+        players = self.stranded.pop(node.identifier, [])
+        players += [player for player in node.players.values() if player not in players]
+        # the ones that left the voice channel while the node was down
+        players = [
+            player
+            for player in players
+            if player.guild is not None and player.guild.voice_client is player
+        ]
+        if not players:
+            return
+
+        self.bot.logger.log(
+            30,
+            f"Lavalink node {node.identifier} has been down for {self.failover_after}s, moving its {len(players)} players",
+        )
+
+        for i, player in enumerate(players):
+            try:
+                target = self.best_node(exclude=node)
+            except wavelink.InvalidNodeException:
+                self.bot.logger.log(40, "No Lavalink node left to move the players to")
+                self.stranded[node.identifier] = players[i:]  # tried again on the next check
+                return
+
+            try:
+                await self.migrate(player, target)
+            except Exception as e:
+                self.bot.logger.log(
+                    40, f"Failed to move the player of {player.guild} to {target.identifier}: {e!r}"
+                )
+
+    async def migrate(self, player: wavelink.Player, node: wavelink.Node) -> None:
+        """Move a player to another node, resuming its track at the same position with the same filters and volume.
+
+        wavelink 3 has no public way of switching a player's node, see `move_player`.
+        """
+        guild_id = player.guild.id
+        current = player.current
+        position = player.position
+        paused = player.paused
+
+        await move_player(player, node)
+
+        if current is not None:
+            await player.play(
+                current,
+                start=position,
+                paused=paused,
+                volume=player.volume,
+                filters=player.filters,
+                add_history=False,
+            )
+
+        if (cache := self.bot.sponsorblock_cache.get(guild_id)) is not None:
+            await node.send(
+                "PUT",
+                path=f"v4/sessions/{node.session_id}/players/{guild_id}/sponsorblock/categories",
+                data=cache.active_categories,
+            )
+
+        self.bot.logger.log(20, f"Moved the player of {player.guild} to the Lavalink node {node.identifier}")
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import random
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+import aiofiles
+import asyncpraw
+import orjson
+
+if TYPE_CHECKING:
+    from bot import CritBot
+
+
+class Meme(NamedTuple):
+    title: str
+    url: str
+    permalink: str
+
+
+class MemeFeed:
+    """The top posts of some subreddits, refreshed in the background every `refresh_interval` seconds.
+
+    Only the title, url and permalink of each post are kept, and the pool is saved to `path` so a restart serves memes before Reddit answers.
+    Every guild goes through the whole pool in a random order before seeing a meme again.
+    """
+
+    __slots__ = (
+        "bot",
+        "subreddits",
+        "limit",
+        "time_filter",
+        "refresh_interval",
+        "path",
+        "memes",
+        "decks",
+        "seen",
+        "task",
+    )
+
+    def __init__(
+        self,
+        bot: "CritBot",
+        subreddits: Optional[list[str]] = None,
+        limit: int = 100,
+        time_filter: str = "week",
+        refresh_interval: float = 3600,
+        path: str = "./data/memes.json",
+    ) -> None:
+        self.bot = bot
+        self.subreddits = subreddits or ["memes"]
+        self.limit = limit  # posts per subreddit
+        self.time_filter = time_filter
+        self.refresh_interval = refresh_interval
+        self.path = path
+
+        self.memes: list[Meme] = []
+        self.decks: dict[int, list[Meme]] = {}  # guild id: the memes it will see next, popped from the end
+        self.seen: dict[int, set[str]] = {}  # guild id: permalinks seen since it last went through the whole pool
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start refreshing the memes in the background, `load` the saved ones first to serve them meanwhile."""
+        self.task = self.bot.loop.create_task(self.run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                # the pool that was already there keeps being served
+                self.bot.logger.log(30, f"Failed to refresh the memes: {e!r}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def next(self, guild_id: int) -> Optional[Meme]:
+        """The next meme of a guild, None if the pool is empty (Reddit never answered and there was nothing saved)."""
+        if not self.memes:
+            return None
+
+        deck = self.decks.get(guild_id)
+        if not deck:
+            seen = self.seen.setdefault(guild_id, set())
+            deck = [meme for meme in self.memes if meme.permalink not in seen]
+            if not deck:
+                seen.clear()
+                deck = list(self.memes)
+            random.shuffle(deck)
+            self.decks[guild_id] = deck
+
+        meme = deck.pop()
+        self.seen[guild_id].add(meme.permalink)
+        return meme
+
+    async def refresh(self) -> None:
+        memes: dict[str, Meme] = {}  # permalink: meme, the same post can be on the top of more than one subreddit
+        async with asyncpraw.Reddit(**self.bot.reddit_cred) as reddit:
+            reddit.read_only = True
+            for name in self.subreddits:
+                subreddit = await reddit.subreddit(name)
+                async for submission in subreddit.top(limit=self.limit, time_filter=self.time_filter):
+                    memes[submission.permalink] = Meme(
+                        submission.title, submission.url, submission.permalink
+                    )
+
+        if not memes:
+            return
+
+        self.replace(list(memes.values()))
+        await self.save()
+        self.bot.logger.log(20, f"Refreshed the memes ({len(self.memes)})")
+
+    def replace(self, memes: list[Meme]) -> None:
+        self.memes = memes
+        # the decks are dealt again from the new pool, skipping what each guild already saw
+        permalinks = {meme.permalink for meme in memes}
+        self.decks.clear()
+        for seen in self.seen.values():
+            seen &= permalinks
+
+    async def load(self) -> None:
+        try:
+            async with aiofiles.open(self.path, "rb") as f:
+                data = orjson.loads(await f.read())
+        except FileNotFoundError:
+            return
+        except orjson.JSONDecodeError:
+            self.bot.logger.log(30, f"The saved memes in {self.path} are corrupted, ignoring them")
+            return
+
+        self.replace([Meme(*meme) for meme in data])
+
+    async def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # written next to it and renamed, so a crash never leaves a half written file
+        tmp = self.path + ".tmp"
+        async with aiofiles.open(tmp, "wb") as f:
+            await f.write(orjson.dumps([tuple(meme) for meme in self.memes]))
+        os.replace(tmp, self.path)
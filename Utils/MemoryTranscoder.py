@@ -0,0 +1,72 @@
+import asyncio
+import io
+from typing import Optional
+
+
+class TranscodeTooBig(Exception):
+    pass
+
+
+class TranscodeFailed(Exception):
+    pass
+
+
+async def transcode_to_memory(
+    url: str,
+    output_args: list[str],
+    max_size: int,
+    headers: Optional[dict[str, str]] = None,
+    chunk_size: int = 64 * 1024,
+) -> io.BytesIO:
+    """Transcode a media url with ffmpeg straight into memory, nothing is written to disk.
+
+    ffmpeg reads the url itself and writes the audio to a pipe, which is read into a buffer that can be uploaded as is.
+
+    Args:
+        url (str): The media url, e.g. the `url` of the format selected by yt-dlp.
+        output_args (list[str]): The ffmpeg output arguments (codec, bitrate, format), see `DownloadPlan.ffmpeg_args`.
+        max_size (int): The biggest the output can be in bytes, ffmpeg is stopped as soon as it goes over.
+        headers (Optional[dict[str, str]], optional): HTTP headers needed to read the url (yt-dlp's `http_headers`). Defaults to None.
+        chunk_size (int, optional): How much is read from the pipe at a time. Defaults to 64KiB.
+
+    Raises:
+        TranscodeTooBig: If the output went over `max_size`.
+        TranscodeFailed: If ffmpeg failed.
+
+    Returns:
+        io.BytesIO: The transcoded audio, at position 0.
+    """
+    args = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin"]
+    if headers:
+        args += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in headers.items())]
+    args += ["-i", url, *output_args, "pipe:1"]
+
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    # read while stdout is, ffmpeg would block on a full stderr pipe (e.g. an error repeated for every packet)
+    stderr = asyncio.ensure_future(process.stderr.read())
+
+    buffer = io.BytesIO()
+    try:
+        while chunk := await process.stdout.read(chunk_size):
+            buffer.write(chunk)
+            if buffer.tell() > max_size:
+                raise TranscodeTooBig(f"The output is bigger than {max_size} bytes")
+
+        if await process.wait() != 0:
+            raise TranscodeFailed((await stderr).decode(errors="replace").strip())
+    finally:
+        # also covers the caller being cancelled (e.g. timed out)
+        if process.returncode is None:
+            process.kill()
+            # drain what's left in stdout, the process isn't reaped while the pipe is full
+            await process.stdout.read()
+            await process.wait()
+        await stderr
+
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,169 @@
+import bisect
+import math
+import re
+import time
+from typing import Optional
+
+import asyncpg
+from aiohttp import TraceConfig, web
+
+# upper bounds of the buckets in seconds, from a fast cache hit to a slow download
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    """Fixed bucket histogram, observing is a binary search and an increment."""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(BUCKETS)  # per bucket, not cumulative
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile the way Prometheus' `histogram_quantile` does, interpolating inside its bucket.
+
+        The last bucket has no upper bound, so a quantile that falls in it is the bound of the one before.
+        """
+        if not self.count:
+            return math.nan
+
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                upper = BUCKETS[i]
+                lower = BUCKETS[i - 1] if i else 0.0
+                if math.isinf(upper):
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return BUCKETS[-2]
+
+
+class Metrics:
+    """Latency histograms of the bot, labelled per metric, rendered in the Prometheus text format.
+
+    Commands are observed by the bot and the command tree, Postgres queries by a query logger on every connection of the pool,
+    HTTP requests by a trace config on the web client, the Lavalink requests by `CritNode` and the now playing messages by the music cog.
+    """
+
+    __slots__ = ("histograms", "help", "runner")
+
+    def __init__(self) -> None:
+        self.histograms: dict[str, dict[Labels, Histogram]] = {}  # metric: labels: histogram
+        self.help: dict[str, str] = {
+            "critbot_command_seconds": "Time from invoking a command to its completion.",
+            "critbot_lavalink_request_seconds": "Time of the REST requests to Lavalink.",
+            "critbot_postgres_query_seconds": "Time of the Postgres queries.",
+            "critbot_http_request_seconds": "Time of the HTTP requests to external services.",
+            "critbot_now_playing_seconds": "Time from a track change to its now playing message being sent.",
+        }
+        self.runner: Optional[web.AppRunner] = None
+
+    def observe(self, metric: str, seconds: float, **labels: str) -> None:
+        histograms = self.histograms.setdefault(metric, {})
+        key = tuple(sorted(labels.items()))
+        if (histogram := histograms.get(key)) is None:
+            histogram = histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def render(self) -> str:
+        lines = []
+        for metric, histograms in self.histograms.items():
+            if metric in self.help:
+                lines.append(f"# HELP {metric} {self.help[metric]}")
+            lines.append(f"# TYPE {metric} histogram")
+            for labels, histogram in histograms.items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if math.isinf(bound) else repr(bound)
+                    lines.append(f"{metric}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9090) -> None:
+        """Serve the metrics on http://`host`:`port`/metrics."""
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def close(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+    async def init_connection(self, conn: asyncpg.Connection) -> None:
+        """`init` of the Postgres pool, times every query of the connection."""
+        conn.add_query_logger(self.log_query)
+
+    def log_query(self, record: asyncpg.connection.LoggedQuery) -> None:
+        self.observe(
+            "critbot_postgres_query_seconds",
+            record.elapsed,
+            query=_normalize_query(record.query),
+            outcome="ok" if record.exception is None else "error",
+        )
+
+    def trace_config(self) -> TraceConfig:
+        """Times every request of the aiohttp sessions it is given to, labelled by host, method and status."""
+        trace_config = TraceConfig()
+
+        async def on_request_start(session, context, params) -> None:
+            context.started = time.perf_counter()
+
+        async def on_request_end(session, context, params) -> None:
+            self.observe(
+                "critbot_http_request_seconds",
+                time.perf_counter() - context.started,
+                host=params.url.host or "",
+                method=params.method,
+                outcome=str(params.response.status),
+            )
+
+        async def on_request_exception(session, context, params) -> None:
+            self.observe(
+                "critbot_http_request_seconds",
+                time.perf_counter() - context.started,
+                host=params.url.host or "",
+                method=params.method,
+                outcome="error",
+            )
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize_query(query: str, length: int = 80) -> str:
+    # the queries are static strings with parameters, so this keeps the number of labels small
+    return _WHITESPACE.sub(" ", query).strip()[:length]
@@ -1,5 +1,11 @@
+from typing import Awaitable, Callable, Optional
+
 import discord
 from discord.ext import commands
+from lru import LRU
+
+# An async callable that takes a page index and returns the page or None if there is no such page
+PageSource = Callable[[int], Awaitable[Optional[discord.Embed]]]
 
 
 class Simple(discord.ui.View):
@@ -19,6 +25,10 @@ class Simple(discord.ui.View):
         Page to start the pagination on.
     AllowExtInput: bool
         Overrides ability for 3rd party to interract with button.
+    CacheSize: int
+        How many rendered pages to keep when using a page source.
+    JumpThreshold: int
+        Minimum number of pages to show the "jump to page" select.
     """
 
     def __init__(self, *,
@@ -27,30 +37,42 @@ class Simple(discord.ui.View):
                 NextButton: discord.ui.Button = discord.ui.Button(emoji=discord.PartialEmoji(name="\U000025b6")),
                 PageCounterStyle: discord.ButtonStyle = discord.ButtonStyle.grey,
                 InitialPage: int = 0, AllowExtInput: bool = False,
-                ephemeral: bool = False) -> None:
+                ephemeral: bool = False,
+                CacheSize: int = 8,
+                JumpThreshold: int = 5) -> None:
         self.PreviousButton = PreviousButton
         self.NextButton = NextButton
         self.PageCounterStyle = PageCounterStyle
         self.InitialPage = InitialPage
         self.AllowExtInput = AllowExtInput
         self.ephemeral = ephemeral
+        self.JumpThreshold = JumpThreshold
         
-        self.pages = None
+        self.source: PageSource = None
+        self.cache = LRU(CacheSize)  # page index: rendered page
         self.ctx = None
         self.message = None
         self.current_page = None
         self.page_counter = None
-        self.total_page_count = None
+        self.jump_select = None
+        self.total_page_count = None  # None if the source doesn't know how many pages it has
 
         super().__init__(timeout=timeout)
 
-    async def start(self, ctx: discord.Interaction | commands.Context, pages: list[discord.Embed]):
+    async def start(self, ctx: discord.Interaction | commands.Context, pages: Optional[list[discord.Embed]] = None, *,
+                    source: Optional[PageSource] = None, total: Optional[int] = None):
+        """Either pass every page already rendered in `pages` or a `source` that renders them when they are viewed."""
         
         if isinstance(ctx, discord.Interaction):
             ctx = await commands.Context.from_interaction(ctx)
 
-        self.pages = pages
-        self.total_page_count = len(pages)
+        if pages is not None:
+            async def source(index: int) -> Optional[discord.Embed]:
+                return pages[index] if index < len(pages) else None
+            total = len(pages)
+
+        self.source = source
+        self.total_page_count = total
         self.ctx = ctx
         self.current_page = self.InitialPage
 
@@ -64,28 +86,51 @@ class Simple(discord.ui.View):
         self.add_item(self.PreviousButton)
         self.add_item(self.page_counter)
         self.add_item(self.NextButton)
-        if len(pages) == 1:
-            self.message = await ctx.send(embed=self.pages[self.InitialPage], ephemeral=self.ephemeral)
+        if self.total_page_count is not None and self.total_page_count >= self.JumpThreshold:
+            self.jump_select = SimplePaginatorJumpSelect(self)
+            self.add_item(self.jump_select)
+
+        page = await self.get_page(self.InitialPage)
+        if self.total_page_count == 1:
+            self.message = await ctx.send(embed=page, ephemeral=self.ephemeral)
         else:
-            self.message = await ctx.send(embed=self.pages[self.InitialPage], view=self, ephemeral=self.ephemeral)
+            self.message = await ctx.send(embed=page, view=self, ephemeral=self.ephemeral)
+
+    async def get_page(self, index: int) -> Optional[discord.Embed]:
+        page = self.cache.get(index)
+        if page is None:
+            page = await self.source(index)
+            if page is not None:
+                self.cache[index] = page
+        return page
+
+    async def show_page(self, index: int):
+        page = await self.get_page(index)
+        if page is None:
+            # went past the end of a source without a known total, now we know it
+            self.total_page_count = index if index > 0 else 1
+            index = 0
+            page = await self.get_page(index)
+
+        self.current_page = index
+        self.page_counter.label = f"{self.current_page + 1}/{self.total_page_count or '?'}"
+        if self.jump_select:
+            self.jump_select.update_options()
+        await self.message.edit(embed=page, view=self)
 
     async def previous(self):
         if self.current_page == 0:
-            self.current_page = self.total_page_count - 1
+            if self.total_page_count is None:
+                return
+            await self.show_page(self.total_page_count - 1)
         else:
-            self.current_page -= 1
-
-        self.page_counter.label = f"{self.current_page + 1}/{self.total_page_count}"
-        await self.message.edit(embed=self.pages[self.current_page], view=self)
+            await self.show_page(self.current_page - 1)
 
     async def next(self):
-        if self.current_page == self.total_page_count - 1:
-            self.current_page = 0
+        if self.total_page_count is not None and self.current_page == self.total_page_count - 1:
+            await self.show_page(0)
         else:
-            self.current_page += 1
-
-        self.page_counter.label = f"{self.current_page + 1}/{self.total_page_count}"
-        await self.message.edit(embed=self.pages[self.current_page], view=self)
+            await self.show_page(self.current_page + 1)
 
     async def next_button_callback(self, interaction: discord.Interaction):
         if interaction.user != self.ctx.author and self.AllowExtInput:
@@ -103,8 +148,43 @@ class Simple(discord.ui.View):
         await self.previous()
         await interaction.response.defer()
 
+    async def jump_select_callback(self, interaction: discord.Interaction):
+        if interaction.user != self.ctx.author and self.AllowExtInput:
+            embed = discord.Embed(description="You cannot control this pagination because you did not execute it.",
+                                color=discord.Colour.red())
+            return await interaction.response.send_message(embed=embed, ephemeral=True)
+        await self.show_page(int(self.jump_select.values[0]))
+        await interaction.response.defer()
+
 
 
 class SimplePaginatorPageCounter(discord.ui.Button):
     def __init__(self, style: discord.ButtonStyle, TotalPages, InitialPage):
-        super().__init__(label=f"{InitialPage + 1}/{TotalPages}", style=style, disabled=True)
\ No newline at end of file
+        super().__init__(label=f"{InitialPage + 1}/{TotalPages or '?'}", style=style, disabled=True)
+
+
+class SimplePaginatorJumpSelect(discord.ui.Select):
+    """Jump to page select. Selects are limited to 25 options so long sources only get the pages around the current one plus some evenly spaced ones."""
+
+    def __init__(self, paginator: Simple):
+        self.paginator = paginator
+        super().__init__(placeholder="Jump to page", row=1)
+        self.callback = paginator.jump_select_callback
+        self.update_options()
+
+    def update_options(self):
+        total = self.paginator.total_page_count
+        current = self.paginator.current_page
+
+        if total <= 25:
+            indexes = set(range(total))
+        else:
+            indexes = {0, total - 1, *range(max(current - 5, 0), min(current + 6, total))}
+            free = 25 - len(indexes)
+            for spread in range(1, free + 1):
+                indexes.add(int(spread * total / (free + 1)))
+
+        self.options = [
+            discord.SelectOption(label=str(index + 1), value=str(index), default=index == current)
+            for index in sorted(indexes)
+        ]
\ No newline at end of file
@@ -0,0 +1,151 @@
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Optional
+
+import orjson
+import wavelink
+
+if TYPE_CHECKING:
+    from bot import CritBot
+
+    from .CritPlayer import CritPlayer
+
+
+@dataclass(slots=True)
+class PlayerSnapshot:
+    """What is needed to rebuild a player after a restart, tracks are kept as their Lavalink encoded strings."""
+
+    guild_id: int
+    voice_channel_id: int
+    text_channel_id: int
+    message_id: int  # the last command message, used to rebuild the player's context
+    node: str
+    current: Optional[str]
+    position: int  # in milliseconds
+    paused: bool
+    volume: int
+    filters: dict[str, Any]
+    autoplay: int
+    queue_mode: int
+    queue: list[str]
+
+    @classmethod
+    def from_player(cls, player: "CritPlayer") -> Optional["PlayerSnapshot"]:
+        if not player.connected or player.channel is None or player.ctx is None:
+            return None
+
+        return cls(
+            guild_id=player.guild.id,
+            voice_channel_id=player.channel.id,
+            text_channel_id=player.ctx.channel.id,
+            message_id=player.ctx.message.id,
+            node=player.node.identifier,
+            current=player.current.encoded if player.current else None,
+            position=player.position,
+            paused=player.paused,
+            volume=player.volume,
+            filters=player.filters(),
+            autoplay=player.autoplay.value,
+            queue_mode=player.queue.mode.value,
+            # lazy playlist entries have their encoded string too
+            queue=[track.encoded for track in player.queue],
+        )
+
+
+class PlayerStateStore:
+    """Saves the state of every player in the `player_state` table and the Lavalink session ids in `lavalink_sessions`,
+    so a restart can resume the sessions instead of dropping them.
+    Sessions only outlive the bot with a Lavalink the launcher didn't start, otherwise the players are replayed from their state.
+    """
+
+    __slots__ = ("bot",)
+
+    def __init__(self, bot: "CritBot") -> None:
+        self.bot = bot
+
+    async def save(self, players: list["CritPlayer"]) -> int:
+        """Replace the saved state with the one of `players`.
+
+        Returns:
+            int: How many players were saved.
+        """
+        snapshots = [
+            snapshot
+            for player in players
+            if (snapshot := PlayerSnapshot.from_player(player)) is not None
+        ]
+        sessions = [
+            (node.identifier, node.session_id)
+            for node in wavelink.Pool.nodes.values()
+            if node.session_id
+        ]
+
+        async with self.bot.db_pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM player_state;")
+                await conn.executemany(
+                    """
+                    INSERT INTO player_state (guild_id, voice_channel_id, text_channel_id, message_id, node, current, position,
+                    paused, volume, filters, autoplay, queue_mode, queue) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10::jsonb, $11, $12, $13);
+                    """,
+                    [
+                        (
+                            s.guild_id,
+                            s.voice_channel_id,
+                            s.text_channel_id,
+                            s.message_id,
+                            s.node,
+                            s.current,
+                            s.position,
+                            s.paused,
+                            s.volume,
+                            orjson.dumps(s.filters).decode(),
+                            s.autoplay,
+                            s.queue_mode,
+                            s.queue,
+                        )
+                        for s in snapshots
+                    ],
+                )
+                await conn.executemany(
+                    """
+                    INSERT INTO lavalink_sessions (node, session_id) VALUES ($1, $2)
+                    ON CONFLICT (node) DO UPDATE SET session_id = excluded.session_id;
+                    """,
+                    sessions,
+                )
+
+        return len(snapshots)
+
+    async def load(self) -> list[PlayerSnapshot]:
+        async with self.bot.db_pool.acquire() as conn:
+            records = await conn.fetch("SELECT * FROM player_state;")
+
+        return [
+            PlayerSnapshot(
+                guild_id=record["guild_id"],
+                voice_channel_id=record["voice_channel_id"],
+                text_channel_id=record["text_channel_id"],
+                message_id=record["message_id"],
+                node=record["node"],
+                current=record["current"],
+                position=record["position"],
+                paused=record["paused"],
+                volume=record["volume"],
+                filters=orjson.loads(record["filters"]),
+                autoplay=record["autoplay"],
+                queue_mode=record["queue_mode"],
+                queue=record["queue"],
+            )
+            for record in records
+        ]
+
+    async def load_sessions(self) -> dict[str, str]:
+        """The last Lavalink session id of each node (node identifier: session id)."""
+        async with self.bot.db_pool.acquire() as conn:
+            records = await conn.fetch("SELECT node, session_id FROM lavalink_sessions;")
+
+        return {record["node"]: record["session_id"] for record in records}
+
+    async def clear(self) -> None:
+        async with self.bot.db_pool.acquire() as conn:
+            await conn.execute("DELETE FROM player_state;")
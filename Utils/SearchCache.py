@@ -0,0 +1,249 @@
+import asyncio
+import datetime
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Optional
+
+import orjson
+import wavelink
+import yarl
+from discord.ext import commands
+from lru import LRU
+
+from .CritPlayer import PlaylistEntry
+
+if TYPE_CHECKING:
+    from bot import CritBot
+
+# identifiers that generate new audio every time (text to speech), caching them only wastes memory
+UNCACHED_PREFIXES = ("ftts://", "tts://", "speak:")
+
+
+@dataclass(slots=True)
+class SearchCacheEntry:
+    response: dict[str, Any]  # the raw Lavalink /v4/loadtracks response
+    expires: float
+
+
+class LazyPlaylist:
+    """A playlist straight from the raw Lavalink response, its tracks are only built when asked for.
+
+    Queueing a big playlist as `PlaylistEntry` placeholders this way never builds a wavelink.Playable per track.
+    """
+
+    __slots__ = ("name", "tracks")
+
+    def __init__(self, data: dict[str, Any]) -> None:
+        self.name: str = data["info"]["name"]
+        self.tracks: list[dict[str, Any]] = data["tracks"]  # the raw Lavalink tracks
+
+    def __len__(self) -> int:
+        return len(self.tracks)
+
+    def playable(self, index: int) -> wavelink.Playable:
+        return wavelink.Playable(data=self.tracks[index])
+
+    def entries(
+        self, start: int = 0, ctx: Optional[commands.Context] = None
+    ) -> list[PlaylistEntry]:
+        return [PlaylistEntry.from_data(track, ctx) for track in self.tracks[start:]]
+
+
+class SearchCache:
+    """Cache for `wavelink.Playable.search` keyed by the normalized query (including the source prefix).
+
+    The raw Lavalink responses are cached instead of the tracks because the music cog sets per request attributes on them (ctx, first_playing),
+    so every lookup builds new wavelink objects. Empty results are cached too, for a shorter time.
+    With `persist` the entries are also kept in the `search_cache` table so they survive restarts.
+    Playlists with more than `max_playlist_tracks` tracks are never kept in memory, only in the table, and text to speech isn't cached at all.
+    """
+
+    __slots__ = (
+        "bot",
+        "memory",
+        "pending",
+        "ttl",
+        "negative_ttl",
+        "persist",
+        "max_playlist_tracks",
+        "hits",
+        "negative_hits",
+        "misses",
+    )
+
+    def __init__(
+        self,
+        bot: "CritBot",
+        capacity: int = 2048,
+        ttl: int = 6 * 60 * 60,
+        negative_ttl: int = 10 * 60,
+        persist: bool = False,
+        max_playlist_tracks: int = 100,
+    ) -> None:
+        self.bot = bot
+        self.memory: LRU = LRU(capacity)
+        self.pending: dict[str, asyncio.Task] = {}
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.persist = persist
+        self.max_playlist_tracks = max_playlist_tracks
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Hit/miss counters, `hits` includes the `negative_hits`."""
+        return {
+            "size": len(self.memory),
+            "capacity": self.memory.get_size(),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+        }
+
+    @staticmethod
+    def normalize(query: str, source: Optional[str] = "ytmsearch") -> str:
+        """The Lavalink identifier for a query, the same one `wavelink.Playable.search` would use.
+
+        Links are kept as they are since their paths and parameters can be case sensitive,
+        search terms are lowercased and their whitespace collapsed so trivially different queries share an entry.
+        """
+        query = query.strip()
+        if yarl.URL(query).host:
+            return query
+
+        query = " ".join(query.split()).lower()
+        if not source:
+            return query
+        return f"{source.removesuffix(':')}:{query}"
+
+    async def search(
+        self, query: str, source: Optional[str] = "ytmsearch", *, lazy: bool = False
+    ) -> wavelink.Search | LazyPlaylist:
+        """Drop-in replacement for `wavelink.Playable.search` that only asks Lavalink on a miss.
+
+        Args:
+            query (str): The query or link.
+            source (Optional[str], optional): The search prefix used if the query isn't a link. Defaults to "ytmsearch" (YouTube Music, like wavelink).
+            lazy (bool, optional): Return playlists as a `LazyPlaylist` instead of a wavelink.Playlist. Defaults to False.
+
+        Raises:
+            wavelink.LavalinkLoadException: If Lavalink failed to load the query, errors aren't cached.
+
+        Returns:
+            wavelink.Search | LazyPlaylist: New track objects built from the cached response.
+        """
+        identifier = self.normalize(query, source)
+
+        entry: SearchCacheEntry | None = self.memory.get(identifier)
+        if entry is None and self.persist:
+            entry = await self.__get_db(identifier)
+            if entry is not None and self.fits_memory(entry.response):
+                self.memory[identifier] = entry
+
+        if entry is not None and entry.expires > time.time():
+            self.hits += 1
+            if entry.response["loadType"] == "empty":
+                self.negative_hits += 1
+            return self.build(entry.response, lazy)
+
+        self.misses += 1
+        task = self.pending.get(identifier)
+        if task is None:
+            task = self.bot.loop.create_task(self.__load(identifier))
+            self.pending[identifier] = task
+            task.add_done_callback(lambda _: self.pending.pop(identifier, None))
+
+        # shield so a cancelled caller doesn't cancel the request for everyone else
+        return self.build(await asyncio.shield(task), lazy)
+
+    async def __load(self, identifier: str) -> dict[str, Any]:
+        node = wavelink.Pool.get_node()
+        response: dict[str, Any] = await node.send(
+            "GET", path="v4/loadtracks", params={"identifier": identifier}
+        )
+
+        match response["loadType"]:
+            case "error":
+                raise wavelink.LavalinkLoadException(data=response["data"])
+            case "empty":
+                ttl = self.negative_ttl
+            case "track" if response["data"]["info"]["isStream"]:
+                return response  # live streams can go offline at any moment
+            case "track" | "search" | "playlist":
+                ttl = self.ttl
+            case _:
+                return response
+
+        if identifier.startswith(UNCACHED_PREFIXES):
+            return response
+
+        entry = SearchCacheEntry(response=response, expires=time.time() + ttl)
+        if self.fits_memory(response):
+            self.memory[identifier] = entry
+        if self.persist:
+            self.bot.create_task(self.__set_db(identifier, entry))
+        return response
+
+    def fits_memory(self, response: dict[str, Any]) -> bool:
+        # a few big playlists would pin thousands of raw tracks in the LRU
+        return (
+            response["loadType"] != "playlist"
+            or len(response["data"]["tracks"]) <= self.max_playlist_tracks
+        )
+
+    @staticmethod
+    def build(
+        response: dict[str, Any], lazy: bool = False
+    ) -> wavelink.Search | LazyPlaylist:
+        """Builds the wavelink objects from a raw Lavalink response, like `wavelink.Pool.fetch_tracks` does.
+        With `lazy` a playlist is a `LazyPlaylist`.
+        """
+        match response["loadType"]:
+            case "track":
+                return [wavelink.Playable(data=response["data"])]
+            case "search":
+                return [wavelink.Playable(data=data) for data in response["data"]]
+            case "playlist" if lazy:
+                return LazyPlaylist(response["data"])
+            case "playlist":
+                return wavelink.Playlist(data=response["data"])
+            case _:
+                return []
+
+    async def __get_db(self, identifier: str) -> SearchCacheEntry | None:
+        async with self.bot.db_pool.acquire() as conn:
+            record = await conn.fetchrow(
+                "SELECT response, expires_at FROM search_cache WHERE identifier = $1;",
+                identifier,
+            )
+
+        if record is None:
+            return None
+
+        return SearchCacheEntry(
+            response=orjson.loads(record["response"]),
+            expires=record["expires_at"].timestamp(),
+        )
+
+    async def __set_db(self, identifier: str, entry: SearchCacheEntry) -> None:
+        async with self.bot.db_pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO search_cache (identifier, response, expires_at) VALUES ($1, $2::jsonb, $3)
+                ON CONFLICT (identifier) DO UPDATE SET response = excluded.response, expires_at = excluded.expires_at;
+                """,
+                identifier,
+                orjson.dumps(entry.response).decode(),
+                datetime.datetime.fromtimestamp(entry.expires, datetime.timezone.utc),
+            )
+
+    async def prune(self) -> None:
+        """Deletes the expired entries from the database."""
+        if not self.persist:
+            return
+
+        async with self.bot.db_pool.acquire() as conn:
+            await conn.execute("DELETE FROM search_cache WHERE expires_at < now();")
@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from enum import Enum
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 from wavelink import Node
 import asyncio
 
@@ -67,16 +67,20 @@ class SponsorBlock:
             )
 
     async def update_categories(
-        self, guild_id: int, categories: list[str], node: Node
+        self, guild_id: int, categories: list[str], node: Optional[Node]
     ) -> None:
         """Update the guild's sponsorblock categories.
 
         Args:
             guild_id (int): The guild id.
             categories (list[str]): The categories to be updated.
-            node (Node): The wavelink node.
+            node (Optional[Node]): The wavelink node of the guild's player, None if the guild has no player.
         """
 
+        if node is None:
+            await self.__update_categories_db(guild_id, categories)
+            return
+
         await asyncio.gather(
             self.__update_categories_db(guild_id, categories),
             node.send(
@@ -1,5 +1,13 @@
+import asyncio
+import time
+
 import lxml.html
 import aiohttp
+import orjson
+from lru import LRU
+
+# what get_info returns when Spotify keeps rejecting the access token
+UNKNOWN_INFO = ("N/A", "N/A", "N/A", None)
 
 
 class SpotifyTrackInfo:
@@ -7,12 +15,36 @@ class SpotifyTrackInfo:
 
     It is a reverse-engineering of the Spotify website and API.
     This is because the official Spotify API doesn't provide the monthly listeners of an artist nor the total play count of a track.
-    """
 
-    __slots__ = ("session", "artist_url", "api_partner_url")
+    The access token scraped from the artist page is reused until it expires or gets rejected and the monthly listeners are cached per artist,
+    so a playlist from a single artist only costs one artist page fetch.
+    """
 
-    def __init__(self, session: aiohttp.ClientSession) -> None:
+    __slots__ = (
+        "session",
+        "artist_url",
+        "api_partner_url",
+        "access_token",
+        "access_token_expires",
+        "monthly_listeners",
+        "monthly_listeners_ttl",
+        "pending_artists",
+        "token_lock",
+    )
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        monthly_listeners_ttl: int = 60 * 60,
+        capacity: int = 512,
+    ) -> None:
         self.session = session
+        self.access_token: str | None = None
+        self.access_token_expires = 0.0
+        self.monthly_listeners: LRU = LRU(capacity)  # artist id: (monthly listeners, expires at)
+        self.monthly_listeners_ttl = monthly_listeners_ttl
+        self.pending_artists: dict[str, asyncio.Task] = {}
+        self.token_lock = asyncio.Lock()  # one refresh at a time when a token is rejected
         self.artist_url = "https://open.spotify.com/artist/{artist_id}"
         self.api_partner_url = 'https://api-partner.spotify.com/pathfinder/v1/query?operationName=getTrack&variables={{"uri":"spotify:track:{spotify_track}"}}&extensions={{"persistedQuery":{{"version":1,"sha256Hash":"ae85b52abb74d20a4c331d4143d4772c95f34757bfa8c625474b912b9055b5c0"}}}}'
 
@@ -35,7 +67,15 @@ class SpotifyTrackInfo:
                 if len(data) >= 32768:
                     return bytes(data)
 
-    def __parse_partial_artist_page(self, data: bytes) -> tuple[str, str]:
+    def __parse_partial_artist_page(self, data: bytes) -> tuple[str, float, str]:
+        """Parses the partial artist page.
+
+        Args:
+            data (bytes): The first 32768 bytes of the artist page.
+
+        Returns:
+            tuple[str, float, str]: The access token, the timestamp (in seconds) when it expires and the monthly listeners.
+        """
         monthly_listeners = []
         current = 1700  # 1700 is approximately a good index to start looking for the monthly listeners
 
@@ -58,16 +98,69 @@ class SpotifyTrackInfo:
 
         script_content = html.xpath('//script[@id="session"]')[0].text_content()
 
-        # The token is 115 chars long and ignore the first 16 chars because they are the '{"accessToken":"' part
-        access_token = script_content[16:131]
+        # {"accessToken":"...","accessTokenExpirationTimestampMs":...,"isAnonymous":true}
+        session = orjson.loads(script_content)
+        access_token = session["accessToken"]
+        expires = session.get(
+            "accessTokenExpirationTimestampMs", (time.time() + 60 * 60) * 1000
+        )
 
-        return access_token, monthly_listeners
+        return access_token, expires / 1000, monthly_listeners
+
+    async def __fetch_artist(self, artist_id: str) -> str:
+        """Fetches the artist page and refreshes both the access token and the artist's monthly listeners.
+
+        Args:
+            artist_id (str): The Spotify artist ID.
+
+        Returns:
+            str: The monthly listeners.
+        """
+        artist_page = await self.__get_artist_page(artist_id)
+        (
+            self.access_token,
+            self.access_token_expires,
+            monthly_listeners,
+        ) = self.__parse_partial_artist_page(artist_page)
+
+        self.monthly_listeners[artist_id] = (
+            monthly_listeners,
+            time.time() + self.monthly_listeners_ttl,
+        )
+        return monthly_listeners
+
+    async def __get_artist(self, artist_id: str) -> str:
+        """Same as `__fetch_artist` but concurrent lookups for the same artist share a single request."""
+        task = self.pending_artists.get(artist_id)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(
+                self.__fetch_artist(artist_id)
+            )
+            self.pending_artists[artist_id] = task
+            task.add_done_callback(
+                lambda _: self.pending_artists.pop(artist_id, None)
+            )
+        return await asyncio.shield(task)
+
+    def __get_cached_monthly_listeners(self, artist_id: str) -> str | None:
+        cached = self.monthly_listeners.get(artist_id)
+        if cached is None or cached[1] < time.time():
+            return None
+        return cached[0]
+
+    @property
+    def has_valid_token(self) -> bool:
+        # 30 seconds of margin so the token doesn't expire mid request
+        return (
+            self.access_token is not None
+            and self.access_token_expires - 30 > time.time()
+        )
 
     async def __get_track_info(
         self,
         spotify_track: str,
         bearer_token: str,
-    ) -> bytes:
+    ) -> bytes | None:
         """Fetches the track info from the Spotify API. Usually this payload is huge, but we only need approximately the first 900 bytes. Im still getting the first 1024 just to be sure that songs with long titles are covered.
 
         Args:
@@ -75,12 +168,14 @@ class SpotifyTrackInfo:
             bearer_token (str): The Spotify access token.
 
         Returns:
-            bytes: The first 1024 bytes of the response.
+            bytes | None: The first 1024 bytes of the response or None if the token was rejected.
         """
         url = self.api_partner_url.format(spotify_track=spotify_track)
         async with self.session.get(
             url, headers={"authorization": f"Bearer {bearer_token}"}
         ) as resp:
+            if resp.status == 401:
+                return None
             return await resp.content.read(1024)
 
     def __parse_partial_response(self, data: bytes) -> tuple[str, str, bool]:
@@ -143,11 +238,23 @@ class SpotifyTrackInfo:
 
         Returns:
             tuple[str, str, str, bool]: The monthly listeners, playcount, release date and content rating. The content rating is a boolean. True if the track is explicit, False if it's not and None if it's unknown.
+                `UNKNOWN_INFO` if the token was rejected even after refreshing it.
         """
-        artist_page = await self.__get_artist_page(artist_id)
-
-        bearer_token, monthly_listeners = self.__parse_partial_artist_page(artist_page)
-        response = await self.__get_track_info(spotify_track, bearer_token)
+        monthly_listeners = self.__get_cached_monthly_listeners(artist_id)
+        if monthly_listeners is None or not self.has_valid_token:
+            monthly_listeners = await self.__get_artist(artist_id)
+
+        token = self.access_token
+        response = await self.__get_track_info(spotify_track, token)
+        if response is None:
+            # the token was rejected before expiring, scrape a new one unless a concurrent call already did
+            # the shared token is only ever replaced, the calls in flight keep sending a real one
+            async with self.token_lock:
+                if self.access_token == token:
+                    monthly_listeners = await self.__get_artist(artist_id)
+            response = await self.__get_track_info(spotify_track, self.access_token)
+            if response is None:
+                return UNKNOWN_INFO
 
         return (
             monthly_listeners,
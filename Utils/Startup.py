@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+
+@dataclass(slots=True)
+class StartupPhase:
+    name: str
+    func: Callable[[], Awaitable[object]]
+    after: tuple[str, ...] = ()
+    optional: bool = False  # runs in the background, nothing waits for it and a failure is only logged
+    started: float = 0.0  # seconds since the start of the startup
+    took: float = 0.0  # in seconds
+    failed: bool = False
+    skipped: bool = False  # one of the phases it comes after failed or was skipped, so it never ran
+    done: asyncio.Event = field(default_factory=asyncio.Event)  # set once it finished, failed or was skipped
+
+
+class Startup:
+    """Runs the setup phases of the bot as a dependency graph, every phase starts as soon as the ones it comes after are done.
+    A phase that comes after one that failed is skipped, and so are the ones after it.
+
+    The wall time of each phase is logged as a timeline once the required phases are done, and again for each optional one when it finishes.
+    """
+
+    __slots__ = ("logger", "phases", "start", "background")
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.logger = logger
+        self.phases: dict[str, StartupPhase] = {}
+        self.start = 0.0
+        self.background: set[asyncio.Task] = set()  # keeps the optional phases referenced while they run
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[object]],
+        after: tuple[str, ...] = (),
+        optional: bool = False,
+    ) -> None:
+        """Add a phase, the phases it comes after must be added before it (so there can't be cycles).
+
+        Args:
+            name (str): The name of the phase in the timeline.
+            func (Callable[[], Awaitable[object]]): Coroutine function that runs the phase.
+            after (tuple[str, ...], optional): The phases that must be done before this one starts. Defaults to ().
+            optional (bool, optional): Whether the bot can start without it, optional phases can't come before required ones. Defaults to False.
+
+        Raises:
+            ValueError: If a phase with this name exists or one of the phases in `after` doesn't.
+        """
+        if name in self.phases:
+            raise ValueError(f"The startup phase {name} already exists")
+        for dependency in after:
+            if dependency not in self.phases:
+                raise ValueError(f"The startup phase {name} comes after {dependency}, which wasn't added")
+            if self.phases[dependency].optional and not optional:
+                raise ValueError(f"The startup phase {name} is required but comes after the optional {dependency}")
+
+        self.phases[name] = StartupPhase(name, func, after, optional)
+
+    async def run(self) -> None:
+        """Run every phase, returning once the required ones are done. The optional ones keep running in the background.
+
+        Raises:
+            ExceptionGroup: The exceptions of the required phases that failed, the other phases are cancelled.
+        """
+        self.start = time.perf_counter()
+        required = [phase for phase in self.phases.values() if not phase.optional]
+
+        loop = asyncio.get_running_loop()
+        for phase in self.phases.values():
+            if phase.optional:
+                task = loop.create_task(self.run_phase(phase))
+                self.background.add(task)
+                task.add_done_callback(lambda task, phase=phase: self.optional_done(task, phase))
+
+        async with asyncio.TaskGroup() as group:
+            for phase in required:
+                group.create_task(self.run_phase(phase))
+
+        self.log_timeline(required)
+
+    async def run_phase(self, phase: StartupPhase) -> None:
+        try:
+            for name in phase.after:
+                dependency = self.phases[name]
+                await dependency.done.wait()
+                if dependency.failed or dependency.skipped:
+                    phase.skipped = True
+                    self.logger.log(
+                        30,
+                        f"Startup phase {phase.name} skipped, {name} {'failed' if dependency.failed else 'was skipped'}",
+                    )
+                    return
+
+            phase.started = time.perf_counter() - self.start
+            try:
+                await phase.func()
+            except BaseException:
+                phase.failed = True
+                raise
+            finally:
+                phase.took = time.perf_counter() - self.start - phase.started
+        finally:
+            phase.done.set()
+
+    def optional_done(self, task: asyncio.Task, phase: StartupPhase) -> None:
+        self.background.discard(task)
+        if task.cancelled() or phase.skipped:
+            return
+        if (e := task.exception()) is not None:
+            self.logger.log(40, f"Startup phase {phase.name} failed after {phase.took:.2f}s: {e!r}")
+        else:
+            self.log_timeline([phase])
+
+    def log_timeline(self, phases: list[StartupPhase]) -> None:
+        for phase in sorted(phases, key=lambda phase: phase.started):
+            self.logger.log(
+                20,
+                f"Startup phase {phase.name:<12} +{phase.started:6.2f}s took {phase.took:6.2f}s",
+            )
+        if phases and not phases[0].optional:
+            self.logger.log(20, f"Startup took {time.perf_counter() - self.start:.2f}s")
@@ -0,0 +1,212 @@
+import asyncio
+import datetime
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Optional
+
+import orjson
+from lru import LRU
+
+if TYPE_CHECKING:
+    from bot import CritBot
+
+
+@dataclass(slots=True)
+class TrackInfoEntry:
+    info: dict[str, Any]
+    fetched_at: float
+
+
+class TrackInfoCache:
+    """Two tier cache for the extra info shown in the "now playing" embed (views, likes, monthly listeners, etc).
+
+    The first tier is an in-memory LRU, the second one is the `track_info_cache` table in Postgres so the cache survives restarts.
+    Entries are keyed by (source, identifier) and are served stale while a background refresh is running.
+    """
+
+    __slots__ = (
+        "bot",
+        "memory",
+        "pending",
+        "ttls",
+        "max_stale",
+        "hits",
+        "db_hits",
+        "stale_hits",
+        "misses",
+    )
+
+    default_ttls = {
+        "youtube": 6 * 60 * 60,
+        "soundcloud": 6 * 60 * 60,
+        "spotify": 60 * 60,  # monthly listeners change a lot faster
+    }
+    default_ttl = 60 * 60
+
+    def __init__(
+        self,
+        bot: "CritBot",
+        capacity: int = 1024,
+        ttls: Optional[dict[str, int]] = None,
+        max_stale: int = 7 * 24 * 60 * 60,
+    ) -> None:
+        self.bot = bot
+        self.memory: LRU = LRU(capacity)
+        self.pending: dict[tuple[str, str], asyncio.Task] = {}
+        self.ttls = {**self.default_ttls, **(ttls or {})}
+        self.max_stale = max_stale  # older entries are refetched before being served
+
+        self.hits = 0
+        self.db_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Hit/miss counters, `hits` includes the `db_hits` and the `stale_hits`."""
+        return {
+            "size": len(self.memory),
+            "capacity": self.memory.get_size(),
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+        }
+
+    def get_ttl(self, source: str) -> int:
+        return self.ttls.get(source, self.default_ttl)
+
+    def get_memory(
+        self,
+        source: str,
+        identifier: str,
+        fetch: Callable[[], Awaitable[dict[str, Any] | None]],
+    ) -> TrackInfoEntry | None:
+        """Synchronous lookup of the in-memory tier, so a hit can be used without scheduling anything.
+
+        A stale entry is returned too, and refreshed in the background like `get` does.
+
+        Returns:
+            TrackInfoEntry | None: The entry, None if it isn't in memory or is too old to be served.
+        """
+        key = (source, identifier)
+        entry: TrackInfoEntry | None = self.memory.get(key)
+        if entry is None:
+            return None
+
+        age = time.time() - entry.fetched_at
+        if age >= self.max_stale:
+            return None
+
+        self.hits += 1
+        if age >= self.get_ttl(source):
+            self.stale_hits += 1
+            self.__refresh(key, fetch).add_done_callback(self.__log_refresh_error)
+        return entry
+
+    async def get(
+        self,
+        source: str,
+        identifier: str,
+        fetch: Callable[[], Awaitable[dict[str, Any] | None]],
+    ) -> dict[str, Any] | None:
+        """Get the info of a track, calling `fetch` only if there is nothing usable cached.
+
+        Args:
+            source (str): The track source (youtube, spotify, soundcloud, ...).
+            identifier (str): The track identifier.
+            fetch (Callable[[], Awaitable[dict[str, Any] | None]]): Coroutine function that fetches the info from the source.
+
+        Returns:
+            dict[str, Any] | None: The track info.
+        """
+        key = (source, identifier)
+
+        entry: TrackInfoEntry | None = self.memory.get(key)
+        if entry is None:
+            entry = await self.__get_db(key)
+            if entry is not None:
+                self.db_hits += 1
+                self.memory[key] = entry
+
+        if entry is not None:
+            age = time.time() - entry.fetched_at
+            if age < self.get_ttl(source):
+                self.hits += 1
+                return entry.info
+
+            if age < self.max_stale:
+                self.hits += 1
+                self.stale_hits += 1
+                self.__refresh(key, fetch).add_done_callback(self.__log_refresh_error)
+                return entry.info
+
+        self.misses += 1
+        # shield so a cancelled caller (e.g. a dropped prefetch) doesn't cancel the fetch for everyone else
+        return await asyncio.shield(self.__refresh(key, fetch))
+
+    def __refresh(
+        self,
+        key: tuple[str, str],
+        fetch: Callable[[], Awaitable[dict[str, Any] | None]],
+    ) -> asyncio.Task:
+        """Returns the in-flight fetch for `key`, starting one if there is none so concurrent lookups share it."""
+        task = self.pending.get(key)
+        if task is None:
+            task = self.bot.loop.create_task(self.__load(key, fetch))
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        return task
+
+    async def __load(
+        self,
+        key: tuple[str, str],
+        fetch: Callable[[], Awaitable[dict[str, Any] | None]],
+    ) -> dict[str, Any] | None:
+        info = await fetch()
+        if info is None:
+            return None
+
+        entry = TrackInfoEntry(info=info, fetched_at=time.time())
+        self.memory[key] = entry
+        self.bot.create_task(self.__set_db(key, entry))
+        return info
+
+    def __log_refresh_error(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and (exc := task.exception()) is not None:
+            self.bot.logger.log(30, f"Failed to refresh the track info cache: {exc!r}")
+
+    async def __get_db(self, key: tuple[str, str]) -> TrackInfoEntry | None:
+        async with self.bot.db_pool.acquire() as conn:
+            record = await conn.fetchrow(
+                "SELECT info, fetched_at FROM track_info_cache WHERE source = $1 AND identifier = $2;",
+                *key,
+            )
+
+        if record is None:
+            return None
+
+        return TrackInfoEntry(
+            info=orjson.loads(record["info"]),
+            fetched_at=record["fetched_at"].timestamp(),
+        )
+
+    async def __set_db(self, key: tuple[str, str], entry: TrackInfoEntry) -> None:
+        async with self.bot.db_pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO track_info_cache (source, identifier, info, fetched_at) VALUES ($1, $2, $3::jsonb, $4)
+                ON CONFLICT (source, identifier) DO UPDATE SET info = excluded.info, fetched_at = excluded.fetched_at;
+                """,
+                *key,
+                orjson.dumps(entry.info).decode(),
+                datetime.datetime.fromtimestamp(entry.fetched_at, datetime.timezone.utc),
+            )
+
+    async def prune(self) -> None:
+        """Deletes the entries that are too old to be served even as stale."""
+        async with self.bot.db_pool.acquire() as conn:
+            await conn.execute(
+                "DELETE FROM track_info_cache WHERE fetched_at < now() - make_interval(secs => $1);",
+                float(self.max_stale),
+            )
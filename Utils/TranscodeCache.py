@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, NamedTuple
+
+
+class TranscodeKey(NamedTuple):
+    extractor: str
+    id: str
+    codec: str
+    bitrate: str
+
+    @property
+    def file_name(self) -> str:
+        # hashed because the ids of some extractors aren't safe file names
+        digest = hashlib.sha256("\0".join(self).encode()).hexdigest()[:32]
+        return f"{digest}.{self.codec}"
+
+
+class TranscodeCache:
+    """On disk LRU of transcoded downloads, keyed by (extractor, video id, codec, bitrate) and limited by a byte budget.
+
+    Concurrent requests for the same key share a single download, and a hit is just the path of the cached file.
+    The index is rebuilt from the directory when the bot starts, oldest files first.
+    """
+
+    __slots__ = ("path", "budget", "used", "files", "pending", "hits", "misses", "shared")
+
+    def __init__(self, path: str, budget: int = 2 * 1024 * 1024 * 1024) -> None:
+        self.path = path
+        self.budget = budget  # in bytes
+        self.used = 0
+        self.files: OrderedDict[str, int] = OrderedDict()  # file name: size, least recently used first
+        self.pending: dict[str, asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0  # requests that joined a download that was already running
+
+        os.makedirs(self.path, exist_ok=True)
+        entries = sorted(
+            (entry for entry in os.scandir(self.path) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in entries:
+            size = entry.stat().st_size
+            self.files[entry.name] = size
+            self.used += size
+        self.__evict()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "files": len(self.files),
+            "used": self.used,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+        }
+
+    async def get(self, key: TranscodeKey, fetch: Callable[[], Awaitable[str]]) -> str:
+        """Get the path of the transcoded file, calling `fetch` only if it isn't cached or being downloaded already.
+
+        The returned file can be evicted by the next download that finishes, so open it before awaiting anything else.
+
+        Args:
+            key (TranscodeKey): What the file is.
+            fetch (Callable[[], Awaitable[str]]): Coroutine function that downloads and transcodes the file and returns its path,
+                the file is moved into the cache.
+
+        Returns:
+            str: The path of the cached file.
+        """
+        name = key.file_name
+        path = os.path.join(self.path, name)
+
+        if name in self.files:
+            if os.path.exists(path):
+                self.hits += 1
+                self.files.move_to_end(name)
+                return path
+            # removed behind our back
+            self.used -= self.files.pop(name)
+
+        task = self.pending.get(name)
+        if task is None:
+            self.misses += 1
+            task = asyncio.get_running_loop().create_task(self.__load(name, fetch))
+            self.pending[name] = task
+            task.add_done_callback(lambda _: self.pending.pop(name, None))
+        else:
+            self.shared += 1
+
+        # shield so a cancelled caller doesn't cancel the download for everyone else
+        return await asyncio.shield(task)
+
+    async def __load(self, name: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        output = await fetch()
+        path = os.path.join(self.path, name)
+
+        # the cache directory is inside the download workspace, so this is a rename
+        os.replace(output, path)
+        size = os.path.getsize(path)
+
+        self.files[name] = size
+        self.used += size
+        self.__evict()
+        return path
+
+    def __evict(self) -> None:
+        # the newest file is always kept, even if it alone is over the budget
+        while self.used > self.budget and len(self.files) > 1:
+            name, size = self.files.popitem(last=False)
+            self.used -= size
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,70 @@
+"""The wavelink internals the bot relies on, in one place and only touched with the version they were written for.
+
+wavelink 3 has no public way to resume a Lavalink session, to forget a player without destroying it or to move a player to another node.
+With another version these do nothing (or raise for `move_player`), so the bot falls back to fresh sessions and players.
+"""
+
+import logging
+
+import wavelink
+
+SUPPORTED_VERSION = "3.4"  # pinned in pyproject.toml
+SUPPORTED = wavelink.__version__.startswith(SUPPORTED_VERSION + ".")
+
+
+def check_version(logger: logging.Logger) -> bool:
+    """Log a warning if the installed wavelink isn't the supported version.
+
+    Returns:
+        bool: Whether it is.
+    """
+    if not SUPPORTED:
+        logger.log(
+            30,
+            f"wavelink {wavelink.__version__} isn't {SUPPORTED_VERSION}, sessions won't be resumed and players won't be moved between nodes",
+        )
+    return SUPPORTED
+
+
+def set_session_id(node: wavelink.Node, session_id: str) -> bool:
+    """Make a node that isn't connected yet resume a Lavalink session instead of starting a new one.
+
+    Returns:
+        bool: Whether the session id was set.
+    """
+    if not SUPPORTED:
+        return False
+    # wavelink only sends the session id of a reconnecting node
+    node._session_id = session_id
+    return True
+
+
+def detach_player(player: wavelink.Player) -> bool:
+    """Forget a player without destroying it on Lavalink or leaving the voice channel.
+
+    `Player.disconnect` does the same plus the DELETE on Lavalink and the voice state update.
+
+    Returns:
+        bool: Whether the player was detached.
+    """
+    if not SUPPORTED:
+        return False
+    player.node._players.pop(player.guild.id, None)
+    player._invalidate()
+    return True
+
+
+async def move_player(player: wavelink.Player, node: wavelink.Node) -> None:
+    """Re-bind a player to another node and send it the voice state, the discord voice connection stays the same.
+
+    Raises:
+        RuntimeError: If the installed wavelink isn't the supported version.
+    """
+    if not SUPPORTED:
+        raise RuntimeError(f"Can't move players with wavelink {wavelink.__version__}")
+
+    # the old node can't be told about it, it's dead
+    player.node._players.pop(player.guild.id, None)
+    player._node = node
+    node._players[player.guild.id] = player
+    await player._dispatch_voice_update()
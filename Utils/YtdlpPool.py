@@ -0,0 +1,275 @@
+import asyncio
+import builtins
+import logging
+import os
+import pickle
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from yt_dlp.utils import DownloadError, YoutubeDLError
+
+from .YtdlpWorker import HEADER
+
+# run as a script, so the workers never import the bot (the launcher, the cogs, ...)
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "YtdlpWorker.py")
+
+logger = logging.getLogger("discord")
+
+
+def _rebuild_exception(name: str, message: str) -> Exception:
+    """The exception a job raised in a worker, which only sends back its type name and message."""
+    cls = getattr(builtins, name, None)
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        return cls(message)
+    # DownloadError, ExtractorError, ... the ones callers catch end up as DownloadError when yt-dlp raises them anyway
+    return DownloadError(message)
+
+
+class _Worker:
+    """One worker process and the parent's ends of its pipes."""
+
+    __slots__ = ("process",)
+
+    def __init__(self, process: asyncio.subprocess.Process) -> None:
+        self.process = process
+
+    @classmethod
+    async def start(cls, opts: dict[str, Any]) -> "_Worker":
+        """Start a worker and wait until its YoutubeDL is ready, without blocking the event loop while it imports yt-dlp."""
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            WORKER_PATH,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        worker = cls(process)
+        try:
+            worker.send(opts)
+            await worker.receive()
+        except BaseException:
+            worker.kill()
+            raise
+        return worker
+
+    def send(self, message: Any) -> None:
+        data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        self.process.stdin.write(HEADER.pack(len(data)) + data)
+
+    async def receive(self) -> Any:
+        """The next message of the worker.
+
+        Raises:
+            asyncio.IncompleteReadError: If the worker died.
+        """
+        (length,) = HEADER.unpack(await self.process.stdout.readexactly(HEADER.size))
+        ok, value = pickle.loads(await self.process.stdout.readexactly(length))
+        if not ok:
+            raise _rebuild_exception(*value)
+        return value
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def call(self, method: str, args: tuple, overrides: Optional[dict[str, Any]]) -> tuple[Any, float, float]:
+        self.send((method, args, overrides))
+        return await self.receive()
+
+    def kill(self) -> None:
+        if self.process.returncode is None:
+            self.process.kill()
+
+
+class YtdlpQueueFull(Exception):
+    pass
+
+
+@dataclass(slots=True)
+class YtdlpLaneStats:
+    jobs: int = 0
+    rejected: int = 0
+    timeouts: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    exec_total: float = 0.0
+    exec_max: float = 0.0
+
+    def record(self, wait: float, execution: float) -> None:
+        self.jobs += 1
+        self.wait_total += wait
+        self.exec_total += execution
+        self.wait_max = max(self.wait_max, wait)
+        self.exec_max = max(self.exec_max, execution)
+
+    @property
+    def wait_avg(self) -> float:
+        return self.wait_total / self.jobs if self.jobs else 0.0
+
+    @property
+    def exec_avg(self) -> float:
+        return self.exec_total / self.jobs if self.jobs else 0.0
+
+
+class YtdlpLane:
+    """A bounded pool of long-lived worker processes, each one with its own pre-initialized YoutubeDL.
+
+    Each job runs on a worker the lane owns, so a job that times out or is cancelled kills its worker, which is replaced by a new one.
+    The workers are separate interpreters running `YtdlpWorker.py`, started in the background so the bot never waits for them to import yt-dlp.
+    """
+
+    __slots__ = (
+        "name",
+        "opts",
+        "idle",
+        "workers",
+        "max_queue",
+        "timeout",
+        "in_flight",
+        "stats",
+        "spawning",
+        "closed",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        opts: dict[str, Any],
+        workers: int,
+        max_queue: int,
+        timeout: float,
+    ) -> None:
+        self.name = name
+        self.opts = opts
+        self.max_queue = max_queue  # running + waiting jobs
+        self.timeout = timeout
+        self.in_flight = 0
+        self.stats = YtdlpLaneStats()
+
+        self.workers: set[_Worker] = set()  # idle and busy
+        self.idle: asyncio.Queue[_Worker] = asyncio.Queue()
+        self.spawning: set[asyncio.Task] = set()
+        self.closed = False
+        for _ in range(workers):
+            self.spawn()
+
+    def spawn(self) -> None:
+        """Start a worker in the background, it joins the idle ones once it's ready."""
+        task = asyncio.get_running_loop().create_task(self.__spawn())
+        self.spawning.add(task)
+        task.add_done_callback(self.__spawned)
+
+    async def __spawn(self) -> None:
+        worker = await _Worker.start(self.opts)
+        if self.closed:
+            worker.kill()
+            return
+        self.workers.add(worker)
+        self.idle.put_nowait(worker)
+
+    def __spawned(self, task: asyncio.Task) -> None:
+        self.spawning.discard(task)
+        if task.cancelled() or self.closed:
+            return
+        if (e := task.exception()) is not None:
+            # the lane would be a worker short forever
+            logger.log(40, f"Failed to start a yt-dlp {self.name} worker, retrying: {e!r}")
+            asyncio.get_running_loop().call_later(5, self.spawn)
+
+    async def run(
+        self,
+        method: str,
+        *args,
+        timeout: Optional[float] = None,
+        overrides: Optional[dict[str, Any]] = None,
+    ) -> Any:
+        """Run a YoutubeDL method in one of the lane's workers.
+
+        Args:
+            method (str): The YoutubeDL method name, e.g. "extract_info".
+            timeout (Optional[float], optional): Overrides the lane's timeout in seconds, waiting for a free worker included. Defaults to None.
+            overrides (Optional[dict[str, Any]], optional): YoutubeDL options for this job only, e.g. another format. Defaults to None.
+
+        Raises:
+            YtdlpQueueFull: If the lane already has `max_queue` jobs.
+            asyncio.TimeoutError: If the job took longer than the timeout.
+
+        Returns:
+            Any: Whatever the method returned.
+        """
+        if self.in_flight >= self.max_queue:
+            self.stats.rejected += 1
+            raise YtdlpQueueFull(
+                f"The {self.name} lane is full ({self.max_queue} jobs)"
+            )
+
+        self.in_flight += 1
+        submitted = time.monotonic()
+        try:
+            async with asyncio.timeout(timeout or self.timeout):
+                worker = await self.idle.get()
+                try:
+                    result, start, end = await worker.call(method, args, overrides)
+                except BaseException as e:
+                    if (
+                        isinstance(e, Exception)
+                        and worker.alive
+                        and not isinstance(e, asyncio.IncompleteReadError)
+                    ):
+                        # the job itself failed, the worker is fine
+                        self.idle.put_nowait(worker)
+                    else:
+                        # timed out, cancelled or dead: the job can't be stopped any other way
+                        worker.kill()
+                        self.workers.discard(worker)
+                        self.spawn()
+                    raise
+                self.idle.put_nowait(worker)
+        except TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+        self.stats.record(start - submitted, end - start)
+        return result
+
+    def shutdown(self) -> None:
+        self.closed = True
+        for task in self.spawning:
+            task.cancel()
+        for worker in self.workers:
+            worker.kill()
+        self.workers.clear()
+
+
+class YtdlpPool:
+    """Separate lanes for extracting metadata and for downloading + transcoding so downloads can't starve the "now playing" embeds."""
+
+    __slots__ = ("extract", "download")
+
+    def __init__(
+        self,
+        extract_opts: dict[str, Any],
+        download_opts: dict[str, Any],
+        extract_workers: int = 2,
+        download_workers: int = 2,
+        max_queue: int = 16,
+        extract_timeout: float = 30,
+        download_timeout: float = 300,
+    ) -> None:
+        self.extract = YtdlpLane(
+            "extract", extract_opts, extract_workers, max_queue, extract_timeout
+        )
+        self.download = YtdlpLane(
+            "download", download_opts, download_workers, max_queue, download_timeout
+        )
+
+    @property
+    def stats(self) -> dict[str, YtdlpLaneStats]:
+        return {"extract": self.extract.stats, "download": self.download.stats}
+
+    def shutdown(self) -> None:
+        self.extract.shutdown()
+        self.download.shutdown()
@@ -0,0 +1,84 @@
+"""Entry point of the yt-dlp worker processes of `YtdlpLane`, run as a script so nothing of the bot is imported in them.
+
+The parent sends the YoutubeDL options, then one job at a time, every message is a pickle prefixed by its length.
+"""
+
+import os
+import pickle
+import struct
+import sys
+import time
+from typing import Any, BinaryIO, Optional
+
+from yt_dlp import YoutubeDL
+
+HEADER = struct.Struct("!I")  # the length of the pickle that follows
+
+
+def read_message(stream: BinaryIO) -> Any:
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise EOFError
+    (length,) = HEADER.unpack(header)
+    return pickle.loads(stream.read(length))
+
+
+def write_message(stream: BinaryIO, message: Any) -> None:
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def run(
+    ytdlp: YoutubeDL,
+    opts: dict[str, Any],
+    method: str,
+    args: tuple,
+    overrides: Optional[dict[str, Any]] = None,
+) -> tuple[Any, float, float]:
+    """Runs a YoutubeDL method.
+
+    Jobs with `overrides` get a short lived YoutubeDL with those options on top of the worker's,
+    creating one doesn't touch the network.
+
+    Returns:
+        tuple[Any, float, float]: The result and the monotonic start and end times of the job.
+    """
+    start = time.monotonic()
+    if overrides:
+        with YoutubeDL({**opts, **overrides}) as job_ytdlp:
+            result = getattr(job_ytdlp, method)(*args)
+    else:
+        result = getattr(ytdlp, method)(*args)
+
+    if method in ("extract_info", "process_ie_result") and result is not None:
+        # the raw info dict isn't always picklable
+        result = YoutubeDL.sanitize_info(result)
+    return result, start, time.monotonic()
+
+
+def main() -> None:
+    # the messages get their own copy of stdout, whatever yt-dlp prints goes to stderr instead
+    output = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    source = sys.stdin.buffer
+
+    opts = read_message(source)
+    ytdlp = YoutubeDL(opts)
+    write_message(output, (True, None))  # ready
+
+    while True:
+        try:
+            method, args, overrides = read_message(source)
+        except EOFError:
+            return
+
+        try:
+            write_message(output, (True, run(ytdlp, opts, method, args, overrides)))
+        except Exception as e:
+            # yt-dlp's exceptions carry a traceback and can't be pickled, the parent rebuilds them
+            write_message(output, (False, (type(e).__name__, str(e))))
+
+
+if __name__ == "__main__":
+    main()
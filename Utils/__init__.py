@@ -1,6 +1,25 @@
 from . import Paginator
+from .CritPlayer import CritPlayer, CritQueue, PlaylistEntry
 from .CritHelpCommand import CritHelpCommand
 from .GeniusLyrics import SongNotFound, GeniusLyrics
 from .SponsorBlock import SponsorBlock, SponsorBlockCache, SponsorBlockCategories
 from .Converters import BoolConverter
+from .CommandSync import CommandSync
+from .DownloadPlan import DownloadPlan, plan_download
+from .DownloadWorkspace import (
+    DownloadReservation,
+    DownloadWorkspace,
+    DownloadWorkspaceFull,
+)
+from .LavalinkNodes import CritNode, LavalinkNodes, node_penalty
+from .PlayerState import PlayerSnapshot, PlayerStateStore
+from .MemeFeed import Meme, MemeFeed
+from .Metrics import Histogram, Metrics
+from .MemoryTranscoder import TranscodeFailed, TranscodeTooBig, transcode_to_memory
+from .Startup import Startup, StartupPhase
 from .SpotifyTrackInfo import SpotifyTrackInfo
+from .SearchCache import LazyPlaylist, SearchCache, SearchCacheEntry
+from .TrackInfoCache import TrackInfoCache, TrackInfoEntry
+from .TranscodeCache import TranscodeCache, TranscodeKey
+from .YtdlpPool import YtdlpPool, YtdlpQueueFull
+from .WavelinkInternals import detach_player, move_player, set_session_id
@@ -7,7 +7,6 @@ from collections import deque
 from typing import Optional
 
 import asyncpg
-import asyncpraw
 import discord
 import uvloop
 import wavelink
@@ -16,10 +15,20 @@ from discord.ext import commands, tasks
 
 from i18n import I18n, Translator
 from Utils import (
+    CommandSync,
     CritHelpCommand,
+    CritNode,
+    LavalinkNodes,
+    MemeFeed,
+    Metrics,
+    PlayerStateStore,
+    SearchCache,
     SponsorBlock,
     SponsorBlockCache,
     SponsorBlockCategories,
+    Startup,
+    TrackInfoCache,
+    set_session_id,
 )
 
 
@@ -43,6 +52,17 @@ class CritBot(commands.Bot):
         genius_token: str,
         spotify_cred: dict[str, str],
         reddit_cred: dict[str, str],
+        metrics: Metrics,
+        track_info: Optional[dict] = None,
+        ytdlp_workers: Optional[dict] = None,
+        search_cache: Optional[dict] = None,
+        download_workspace: Optional[dict] = None,
+        transcode_cache: Optional[dict] = None,
+        lavalink_cluster: Optional[dict] = None,
+        meme_feed: Optional[dict] = None,
+        metrics_endpoint: Optional[dict] = None,
+        lavalink_ready: Optional[asyncio.Task[bool]] = None,
+        owns_lavalink: bool = False,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
@@ -62,19 +82,29 @@ class CritBot(commands.Bot):
         self.genius_token = genius_token
         self.spotify_cred = spotify_cred
         self.reddit_cred = reddit_cred
-
-        self.submissions = []
-        self.reddit: asyncpraw.Reddit = None
+        self.track_info = track_info or {}
+        self.ytdlp_workers = ytdlp_workers or {}
+        self.search_cache_settings = search_cache or {}
+        self.download_workspace = download_workspace or {}
+        self.transcode_cache = transcode_cache or {}
+        self.lavalink_cluster = lavalink_cluster or {}
+        self.lavalink_ready = lavalink_ready  # the launcher's readiness probe of the Lavalink it started
+        self.owns_lavalink = owns_lavalink  # the launcher started Lavalink and stops it with the bot
+
+        self.meme_feed = MemeFeed(self, **(meme_feed or {}))
+        self.metrics = metrics
+        self.metrics_endpoint = metrics_endpoint or {}
 
         self.db_pool = db_pool
 
-        self.used_commands: dict[str, int] = {}  # command name: times used
+        self.shutting_down = False  # set by close, so the cogs can tell a shutdown from a reload
+        self.used_commands: dict[tuple[int, str], int] = {}  # (guild id, command name): times used
 
         # i18n
         self.default_language = default_language
         self.i18n = i18n
 
-        self.wavelink_node: wavelink.Node = None
+        self.lavalink_nodes: LavalinkNodes
 
         self.sponsorblock: SponsorBlock
         self.sponsorblock_cache: dict[int, SponsorBlockCache]
@@ -87,6 +117,9 @@ class CritBot(commands.Bot):
             "music_offtopic",
         ]  # has to be a list because sets are not json serializable
 
+        self.track_info_cache: TrackInfoCache
+        self.search_cache: SearchCache
+
         self.loop: uvloop.Loop = asyncio.get_event_loop()
         self.background_tasks = set()
 
@@ -101,63 +134,124 @@ class CritBot(commands.Bot):
 
     # TODO if all the commands can be hybrid command check the new (2.1 feature) interaction.translate to translate per user locale instead of per guild locale
 
-    async def get_reddit_submissions(self) -> asyncpraw.Reddit:
-        async with asyncpraw.Reddit(**self.reddit_cred) as reddit:
-            reddit.read_only = True
-
-            subreddit = await reddit.subreddit("memes")
-
-            async for submission in subreddit.top(limit=100, time_filter="week"):
-                self.submissions.append(submission)
-
-        self.reddit = reddit
-
     async def setup_hook(self) -> None:
-        translator = Translator(i18n=self.i18n)
-        await asyncio.gather(
-            self.get_reddit_submissions(),
-            self.tree.set_translator(translator),
+        self.help_command = CritHelpCommand(i18n=self.i18n, slash=False)
+        self.player_states = PlayerStateStore(self)
+        self.command_sync = CommandSync(self)
+        self.create_caches()
+
+        # independent phases run concurrently, the bot only waits for the required ones
+        self.startup = Startup(self.logger)
+        self.startup.add(
+            "translator", lambda: self.tree.set_translator(Translator(i18n=self.i18n))
         )
+        self.startup.add("lavalink", self.connect_lavalink)
+        self.startup.add("sponsorblock", self.load_sponsorblock)
+        self.startup.add("prune", self.prune_caches, optional=True)
+        self.startup.add("memes", self.start_meme_feed, optional=True)
+        if self.metrics_endpoint.get("enabled"):
+            self.startup.add(
+                "metrics",
+                lambda: self.metrics.serve(
+                    self.metrics_endpoint.get("host", "127.0.0.1"),
+                    self.metrics_endpoint.get("port", 9090),
+                ),
+                optional=True,
+            )
+        self.startup.add("cogs", self.load_cogs, after=("sponsorblock",))
+        self.startup.add("sync", self.sync_commands, after=("translator", "cogs"))
+        await self.startup.run()
 
-        self.help_command = CritHelpCommand(i18n=self.i18n, slash=False)
+        self.batch_update_commands.start()
 
-        # Initiate the lavalink client
-        self.wavelink_node = wavelink.Node(
-            uri=self.lavalink["ip"] + ":" + self.lavalink["port"],
-            password=self.lavalink["password"],
-            inactive_channel_tokens=3,
-            inactive_player_timeout=None,
-        )
-        nodes = [self.wavelink_node]
+    async def connect_lavalink(self) -> None:
+        # Initiate the lavalink client, the main node plus any extra ones from lavalink_cluster
+        cluster = dict(self.lavalink_cluster)
+        nodes = [
+            CritNode(
+                identifier="main",
+                uri=self.lavalink["ip"] + ":" + self.lavalink["port"],
+                password=self.lavalink["password"],
+                inactive_channel_tokens=3,
+                inactive_player_timeout=None,
+            )
+        ]
+        for node in cluster.pop("nodes", None) or []:
+            nodes.append(
+                CritNode(
+                    identifier=node["identifier"],
+                    uri=node["uri"],
+                    password=node["password"],
+                    inactive_channel_tokens=3,
+                    inactive_player_timeout=None,
+                )
+            )
+        self.lavalink_nodes = LavalinkNodes(self, nodes, **cluster)
 
-        await wavelink.Pool.connect(nodes=nodes, client=self, cache_capacity=100)
+        # the rest of the startup doesn't need Lavalink, only this phase waits for it to be up
+        if self.lavalink_ready is not None and not await self.lavalink_ready:
+            self.logger.log(
+                30, "Lavalink isn't ready, the bot will keep trying to connect to it"
+            )
 
+        # reuse the sessions saved before the last shutdown, Lavalink keeps their players playing
+        # for the node's resume timeout (60s by default) so a restart barely interrupts them
+        # a Lavalink started by the launcher dies with the bot, its sessions are gone
+        if not self.owns_lavalink:
+            sessions = await self.player_states.load_sessions()
+            for node in nodes:
+                if (session_id := sessions.get(node.identifier)) is not None:
+                    set_session_id(node, session_id)
+
+        # searches are cached by self.search_cache
+        await wavelink.Pool.connect(nodes=nodes, client=self)
+        self.lavalink_nodes.start()
+
+    async def load_sponsorblock(self) -> None:
         self.sponsorblock = SponsorBlock(self)
         self.sponsorblock_cache = await self.sponsorblock.get_cache()
         self.sponsorblock_categories = {
             category.value for category in SponsorBlockCategories
         }
 
-        self.logger.log(20, "Loading the cogs.")
-        # load all cogs in ./cogs
-        for extension in self.initial_extensions:
-            if (
-                not self.dev and extension == "cogs.dev"
-            ):  # only load dev cog if the bot is in dev mode
-                continue
+    def create_caches(self) -> None:
+        # nothing to load, the caches fill up as they're used
+        self.track_info_cache = TrackInfoCache(
+            self,
+            capacity=self.track_info.get("capacity", 1024),
+            ttls=self.track_info.get("ttl"),
+        )
+        self.search_cache = SearchCache(self, **self.search_cache_settings)
+
+    async def prune_caches(self) -> None:
+        await asyncio.gather(self.track_info_cache.prune(), self.search_cache.prune())
 
-            await self.load_extension(extension)
-            self.cogs_state["loaded"].append(extension.replace("cogs.", ""))
-        self.logger.log(20, "Cogs loaded.")
+    async def start_meme_feed(self) -> None:
+        # serves the memes saved before the restart while it refreshes them in the background,
+        # it still refreshes if they can't be read (the phase is logged as failed)
+        try:
+            await self.meme_feed.load()
+        finally:
+            self.meme_feed.start()
+
+    async def load_cogs(self) -> None:
+        # load all cogs in ./cogs, only load dev cog if the bot is in dev mode
+        extensions = [
+            extension
+            for extension in self.initial_extensions
+            if self.dev or extension != "cogs.dev"
+        ]
+        await asyncio.gather(*(self.load_extension(extension) for extension in extensions))
+        self.cogs_state["loaded"].extend(
+            extension.replace("cogs.", "") for extension in extensions
+        )
 
-        self.logger.log(20, "Syncing the bot.")
+    async def sync_commands(self) -> None:
         guild = discord.Object(self.testing_guild_id)
         self.tree.copy_global_to(guild=guild)
-        await self.tree.sync(guild=guild)
-        # await self.tree.sync() # syncs all guilds takes a longe time
-        self.logger.log(20, "Syncing done!")
-
-        self.batch_update_commands.start()
+        # only uploaded when the commands or their translations changed since the last boot
+        await self.command_sync.sync(guild)
+        # await self.command_sync.sync() # syncs all guilds takes a longe time
 
     async def on_ready(self) -> None:
         await self.change_presence(
@@ -245,25 +339,90 @@ class CritBot(commands.Bot):
         if self.dev and self.i18n.command_name != "!!":
             self.last_cmds.append(ctx.message.content)
 
-        self.used_commands[ctx.command.qualified_name] = (
-            self.used_commands.get(ctx.command.qualified_name, 0) + 1
-        )
+        key = (ctx.guild.id, ctx.command.qualified_name)
+        self.used_commands[key] = self.used_commands.get(key, 0) + 1
         return True
 
     @tasks.loop(minutes=5.0)
     async def batch_update_commands(self) -> None:
-        # TODO: add the guild specific commands to the database
-        """Updates the number of time a command has been used to the database"""
-        if any(value for value in self.used_commands.values()):
+        try:
+            await self.flush_used_commands()
+        except Exception as e:
+            # the counts are kept for the next flush, raising would stop the loop for good
+            self.logger.log(40, f"Failed to flush the used commands: {e!r}")
+
+    async def flush_used_commands(self) -> None:
+        """Adds the commands used since the last flush to the global (`commands`) and per guild (`top_commands`) counts.
+
+        Everything is sent in a single statement, so a flush is one round trip no matter how many commands were used.
+        """
+        if not self.used_commands:
+            return
+
+        # swapped first so the commands used while flushing go to the next flush
+        used, self.used_commands = self.used_commands, {}
+        guild_ids, names, counts = zip(*((guild_id, name, count) for (guild_id, name), count in used.items()))
+        try:
             async with self.db_pool.acquire() as conn:
-                for command, count in self.used_commands.items():
-                    query = """
-                    INSERT INTO commands (name, number) VALUES ($1, $2)
-                    ON CONFLICT (name) DO UPDATE SET number = commands.number + excluded.number;
+                await conn.execute(
                     """
-                    await conn.execute(query, command, count)
+                    WITH used AS (
+                        SELECT * FROM unnest($1::BIGINT[], $2::VARCHAR[], $3::INT[]) AS used(guild_id, command_name, usage_count)
+                    ), per_guild AS (
+                        INSERT INTO top_commands (guild_id, command_name, usage_count)
+                        SELECT used.guild_id, used.command_name, used.usage_count FROM used JOIN guilds ON guilds.id = used.guild_id
+                        ON CONFLICT (guild_id, command_name) DO UPDATE SET usage_count = top_commands.usage_count + excluded.usage_count
+                    )
+                    INSERT INTO commands (name, number)
+                    SELECT command_name, sum(usage_count) FROM used GROUP BY command_name
+                    ON CONFLICT (name) DO UPDATE SET number = commands.number + excluded.number;
+                    """,
+                    guild_ids,
+                    names,
+                    counts,
+                )
+        except BaseException:
+            # kept for the next flush, also when cancelled
+            for key, count in used.items():
+                self.used_commands[key] = self.used_commands.get(key, 0) + count
+            raise
+
+        # the cached leaderboards are out of date now
+        self.dispatch("used_commands_flush")
+
+    async def invoke(self, ctx: commands.Context) -> None:
+        # prefix commands and hybrid commands used with a prefix, the app commands are timed by the command tree
+        if ctx.command is None:
+            return await super().invoke(ctx)
+
+        start = time.perf_counter()
+        failed = True  # also when it raised something that isn't a CommandError
+        try:
+            await super().invoke(ctx)
+            failed = ctx.command_failed
+        finally:
+            self.metrics.observe(
+                "critbot_command_seconds",
+                time.perf_counter() - start,
+                command=ctx.command.qualified_name,
+                cog=ctx.cog.qualified_name if ctx.cog else "",
+                outcome="error" if failed else "ok",
+            )
 
-            self.used_commands.clear()  # clear the dict after updating the database so if a command isn't used it won't be updated
+    async def close(self) -> None:
+        self.shutting_down = True
+        # the usage since the last flush would be lost on every restart
+        # stop lets a flush that is running finish instead of cancelling it halfway
+        self.batch_update_commands.stop()
+        if (task := self.batch_update_commands.get_task()) is not None and not task.done():
+            await asyncio.wait([task])
+        try:
+            await self.flush_used_commands()
+        except Exception as e:
+            self.logger.log(40, f"Failed to flush the used commands: {e!r}")
+        self.meme_feed.stop()
+        await self.metrics.close()
+        await super().close()
 
     @property
     def uptime(self) -> str:
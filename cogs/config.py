@@ -1,6 +1,8 @@
 import asyncio
+from typing import Optional
 
 import discord
+import wavelink
 from discord.ext import commands
 
 from bot import CritBot
@@ -52,6 +54,12 @@ class Config(commands.Cog):
                 )
             )
 
+    @staticmethod
+    def player_node(ctx: commands.Context) -> Optional[wavelink.Node]:
+        """The Lavalink node of the guild's player, None if the bot isn't in a voice channel."""
+        player = ctx.voice_client
+        return player.node if isinstance(player, wavelink.Player) else None
+
     async def sponsorblock_show_logic(self, ctx: commands.Context) -> None:
         active_categories = self.bot.sponsorblock_cache[ctx.guild.id].active_categories
 
@@ -133,7 +141,7 @@ class Config(commands.Cog):
             self.bot.sponsorblock.update_categories(
                 ctx.guild.id,
                 self.bot.sponsorblock_cache[ctx.guild.id].active_categories,
-                self.bot.wavelink_node,
+                self.player_node(ctx),
             ),
         )
 
@@ -167,7 +175,7 @@ class Config(commands.Cog):
             self.bot.sponsorblock.update_categories(
                 ctx.guild.id,
                 self.bot.sponsorblock_cache[ctx.guild.id].active_categories,
-                self.bot.wavelink_node,
+                self.player_node(ctx),
             ),
         )
 
@@ -202,7 +210,7 @@ class Config(commands.Cog):
                 self.bot.sponsorblock.update_categories(
                     ctx.guild.id,
                     self.bot.sponsorblock_cache[ctx.guild.id].active_categories,
-                    self.bot.wavelink_node,
+                    self.player_node(ctx),
                 ),
             )
         else:
@@ -219,7 +227,7 @@ class Config(commands.Cog):
                 self.bot.sponsorblock.update_categories(
                     ctx.guild.id,
                     self.bot.sponsorblock_cache[ctx.guild.id].active_categories,
-                    self.bot.wavelink_node,
+                    self.player_node(ctx),
                 ),
             )
 
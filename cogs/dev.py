@@ -173,7 +173,7 @@ class Dev(commands.Cog):
             try:
                 if copy:
                     self.bot.tree.copy_global_to(guild=guild_obj)
-                await self.bot.tree.sync(guild=guild_obj)
+                await self.bot.command_sync.sync(guild_obj, force=True)
             except app_commands.CommandSyncFailure:
                 await ctx.send(self.t("err", "command_sync_failure", mcommand_name="sync"))
 
@@ -184,7 +184,7 @@ class Dev(commands.Cog):
     async def sync_global(self, ctx) -> None:
         async with ctx.typing():
             try:
-                await self.bot.tree.sync()
+                await self.bot.command_sync.sync(force=True)
             except app_commands.CommandSyncFailure:
                 await ctx.send(self.t("err", "command_sync_failure", mcommand_name="sync"))
         await ctx.send(self.t("cmd", "output"))
@@ -239,6 +239,10 @@ class Dev(commands.Cog):
     async def restart(self, ctx):
         # TODO FIX THIS
         await ctx.send(self.t("cmd", "output"))
+        # execv skips closing the bot, save what it would save on close
+        if (music := self.bot.get_cog("Music")) is not None:
+            await music.save_players()
+        await self.bot.flush_used_commands()
         os.execv(sys.executable, ['python3'] + sys.argv)
 
 
@@ -28,13 +28,15 @@ class Events(commands.Cog):
 
         self.log(20, f"Joined {guild.name} ({guild.id})")
         self.bot.tree.copy_global_to(guild=guild)
-        await self.bot.tree.sync(guild=guild)
+        # queued, a burst of joins doesn't burn the sync rate limit
+        self.bot.command_sync.request(guild)
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild: discord.Guild):
         self.bot.prefixes.pop(guild.id)
         async with self.bot.db_pool.acquire() as conn:
             await conn.execute("DELETE FROM guilds WHERE id = $1", guild.id)
+        await self.bot.command_sync.forget(guild)
         self.log(20, f"Left {guild.name} ({guild.id})")
 
     @commands.Cog.listener()
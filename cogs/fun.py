@@ -1,5 +1,4 @@
 import asyncio
-import random
 from typing import Optional
 
 import discord
@@ -48,10 +47,12 @@ class Fun(commands.Cog):
 
     @commands.hybrid_command(aliases=["memes"])
     async def meme(self, ctx):
-        submission = random.choice(self.bot.submissions)
+        meme = self.bot.meme_feed.next(ctx.guild.id)
+        if meme is None:
+            return await ctx.send(self.t("err", "no_memes"))
 
-        embed = discord.Embed(title=submission.title, color=discord.Color.blurple(), url="https://reddit.com" + submission.permalink)
-        embed.set_image(url=submission.url)
+        embed = discord.Embed(title=meme.title, color=discord.Color.blurple(), url="https://reddit.com" + meme.permalink)
+        embed.set_image(url=meme.url)
 
         await ctx.send(embed=embed)
 
@@ -1,6 +1,7 @@
+import time
 import traceback
 from datetime import datetime
-from typing import Optional
+from typing import Literal, Optional
 
 import discord
 import orjson
@@ -8,6 +9,7 @@ from aiofiles import open as async_open
 from discord import app_commands
 from discord.app_commands import locale_str as _T
 from discord.ext import commands
+from lru import LRU
 
 from Utils import CritHelpCommand
 
@@ -46,6 +48,11 @@ class Misc(commands.Cog):
 
         self.log = self.bot.logger.log
 
+        # scope (guild id, 0 for global): (top commands, expires at), cleared on each usage flush
+        self.top_cmds_cache: LRU = LRU(256)
+        self.top_cmds_ttl = 60  # in seconds
+        self.top_cmds_limit = 10
+
         self.show_info_cmd = app_commands.ContextMenu(name="show_info", callback=self.show_info_interaction, extras={"cog_name": "misc"})
         self.bug_report_cmd= app_commands.Command(name="bug_report", description="command_description" , callback=self.bug_report, extras={"cog_name": "misc", "command_name": "bug_report"})
         self.help_test_cmd = app_commands.Command(name="help_slash", description="command_description", callback=self.help_slash, extras={"cog_name": "misc", "command_name": "help_slash"})
@@ -86,35 +93,74 @@ class Misc(commands.Cog):
 
 
 
-    @commands.hybrid_command(aliases=["topcmds", "topcommands", "top_commands", "top"])
-    async def top_cmds(self, ctx: commands.Context):
-        # TODO make this command work per guild
-        pool = self.bot.db_pool
-
-        async with pool.acquire() as conn:
-            values = await conn.fetch("SELECT name, number FROM commands;")
-        
+    @commands.Cog.listener()
+    async def on_used_commands_flush(self) -> None:
+        self.top_cmds_cache.clear()
 
-        values: list[dict[str, int]] = [dict(x) for x in values] 
-        sorted_values = sorted(values, key=lambda x: x["number"], reverse=True)
+    async def fetch_top_cmds(self, guild_id: Optional[int]) -> list[tuple[str, int]]:
+        """The most used commands of a guild, or of every guild if `guild_id` is None, memoized for `top_cmds_ttl` seconds."""
+        scope = guild_id or 0
+        if (cached := self.top_cmds_cache.get(scope)) is not None and cached[1] > time.monotonic():
+            return cached[0]
 
-        embed = discord.Embed(title=self.t("embed", "title") )
-        for i, value in enumerate(sorted_values):
-            if i == 10:
-                break
-            embed.add_field(name=f"{i+1}. {value['name']}", value=self.t("embed", "description", value=value["number"]), inline=False)
+        async with self.bot.db_pool.acquire() as conn:
+            if guild_id is None:
+                records = await conn.fetch(
+                    "SELECT name, number FROM commands ORDER BY number DESC LIMIT $1;",
+                    self.top_cmds_limit,
+                )
+            else:
+                records = await conn.fetch(
+                    """
+                    SELECT command_name AS name, usage_count AS number FROM top_commands
+                    WHERE guild_id = $1 ORDER BY usage_count DESC LIMIT $2;
+                    """,
+                    guild_id,
+                    self.top_cmds_limit,
+                )
 
+        top = [(record["name"], record["number"]) for record in records]
+        self.top_cmds_cache[scope] = (top, time.monotonic() + self.top_cmds_ttl)
+        return top
 
+    @commands.hybrid_command(aliases=["topcmds", "topcommands", "top_commands", "top"])
+    async def top_cmds(self, ctx: commands.Context, scope: Literal["server", "global"] = "server"):
+        if scope == "global":
+            top = await self.fetch_top_cmds(None)
+            embed = discord.Embed(title=self.t("embed", "title"))
+        else:
+            top = await self.fetch_top_cmds(ctx.guild.id)
+            embed = discord.Embed(title=self.t("embed", "title_guild", guild=ctx.guild.name))
 
+        for i, (name, number) in enumerate(top):
+            embed.add_field(name=f"{i+1}. {name}", value=self.t("embed", "description", value=number), inline=False)
 
         await ctx.send(embed=embed)
 
-        
-
-
-
-
-
+    @commands.is_owner()
+    @commands.command(hidden=True)
+    async def latencies(self, ctx: commands.Context, metric: str = "command"):
+        """Shows the p50/p95/p99 latencies of a metric (command, lavalink_request, postgres_query, http_request or now_playing), slowest first."""
+        histograms = self.bot.metrics.histograms.get(f"critbot_{metric}_seconds")
+        if not histograms:
+            return await ctx.send(self.t("err", "no_data", metric=metric))
+
+        rows = sorted(
+            (
+                (
+                    " ".join(value for _, value in labels)[:40],
+                    histogram.count,
+                    *(histogram.quantile(q) * 1000 for q in (0.5, 0.95, 0.99)),
+                )
+                for labels, histogram in histograms.items()
+            ),
+            key=lambda row: row[3],
+            reverse=True,
+        )[:20]
+
+        lines = [f"{'':40} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"]
+        lines += [f"{name:40} {count:>7} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f}" for name, count, p50, p95, p99 in rows]
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
 
     def show_info_builder(self, member: discord.Member) -> discord.Embed:
 
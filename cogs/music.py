@@ -1,21 +1,45 @@
 import asyncio
 import datetime
+import functools
+import math
 import os
+import time
 import urllib.parse
 from typing import Optional, cast
 
-import aiofiles.os
 import discord
 import orjson
 import wavelink
 from discord import app_commands
-from discord.ext import commands
-from yt_dlp import YoutubeDL
-from yt_dlp.utils import ExtractorError
+from discord.ext import commands, tasks
+from yt_dlp.utils import DownloadError, ExtractorError
 
 # import the bot class from bot.py
 from bot import CritBot
-from Utils import BoolConverter, GeniusLyrics, Paginator, SongNotFound, SpotifyTrackInfo
+from Utils import (
+    BoolConverter,
+    CritPlayer,
+    DownloadReservation,
+    DownloadPlan,
+    DownloadWorkspace,
+    DownloadWorkspaceFull,
+    GeniusLyrics,
+    LazyPlaylist,
+    Paginator,
+    PlayerSnapshot,
+    PlaylistEntry,
+    SongNotFound,
+    SpotifyTrackInfo,
+    TranscodeCache,
+    TranscodeFailed,
+    TranscodeKey,
+    TrackInfoEntry,
+    TranscodeTooBig,
+    YtdlpPool,
+    YtdlpQueueFull,
+    plan_download,
+    transcode_to_memory,
+)
 
 
 class Music(commands.Cog):
@@ -23,9 +47,17 @@ class Music(commands.Cog):
         self.bot = bot
         self.t = self.bot.i18n.t
         self.log = self.bot.logger.log
+        # the downloads only use their own directory and reserve their space in it before starting
+        self.downloads = DownloadWorkspace(**self.bot.download_workspace)
+        self.download_wait_timeout = 60  # seconds a download waits in line before giving up
+        self.max_download_size = 25 * 1024 * 1024  # discord's upload limit
+        self.max_download_bitrate = 320  # in kbps
+        self.transcodes = TranscodeCache(
+            os.path.join(self.downloads.path, "cache"), **self.bot.transcode_cache
+        )
         self.ytdlp_download_opts = {
             "format": "bestaudio/best",
-            "outtmpl": "/tmp/%(title)s.%(ext)s",
+            "outtmpl": f"{self.downloads.path}/%(extractor_key)s-%(id)s.%(ext)s",
             "noplaylist": True,
             "nocheckcertificate": True,
             "ignoreerrors": True,
@@ -33,23 +65,25 @@ class Music(commands.Cog):
             "quiet": True,
             "no_warnings": True,
             "default_search": "auto",
-            "postprocessors": [
-                {
-                    "key": "FFmpegExtractAudio",
-                    "preferredcodec": "mp3",
-                    "preferredquality": "320",
-                }
-            ],
+            # the format and the post processor that converts it are chosen per download, see `plan_download`
         }
         self.ytdlp_extract_info_opts = {
             "quiet": True,
             "skip_download": True,
         }
 
-        self.ytdlp_extract = YoutubeDL(self.ytdlp_extract_info_opts)
-        self.ytdlp_download = YoutubeDL(self.ytdlp_download_opts)
+        # every lane has its own worker processes with their own YoutubeDL instance
+        self.ytdlp = YtdlpPool(
+            self.ytdlp_extract_info_opts,
+            self.ytdlp_download_opts,
+            **self.bot.ytdlp_workers,
+        )
         self.SpotifyTrackInfo = SpotifyTrackInfo(self.bot.web_client)
 
+        # the "now playing" message is sent right away and edited once the track info arrives
+        self.enrich_deadline = 10  # seconds to wait for the track info before giving up on it
+        self.enrich_timeouts = 0
+
     @commands.Cog.listener()
     async def on_wavelink_node_ready(
         self, payload: wavelink.NodeReadyEventPayload
@@ -72,8 +106,9 @@ class Music(commands.Cog):
         if player is None:
             return
 
+        changed_at = time.perf_counter()  # the "now playing" latency is measured from here
         if player.queue:
-            track: wavelink.Playable
+            track: wavelink.Playable | PlaylistEntry
             if player.autoplay == wavelink.AutoPlayMode.disabled:
                 track = player.queue.get()
                 self.bot.create_task(player.play(track))
@@ -82,27 +117,48 @@ class Music(commands.Cog):
                     0
                 ]  # get the next track without removing it from the queue because the autoplay will already remove it
 
+            if isinstance(track, PlaylistEntry):
+                # the look-ahead fell behind (e.g. skipping fast), the player decodes it before playing
+                # and on_wavelink_track_start sends its info message
+                return
+
             if (
                 track.source != "flowery-tts" and not track.first_playing
             ):  # the info message is already sent if the track is the first one and it's not a tts track
-                self.bot.create_task(self.send_info_message(player.ctx, track))
+                self.bot.create_task(
+                    self.send_info_message(player.ctx, track, changed_at=changed_at)
+                )
 
     @commands.Cog.listener()
     async def on_wavelink_track_start(
         self, payload: wavelink.TrackStartEventPayload
     ) -> None:
-        player: wavelink.Player | None = payload.player
+        player: CritPlayer | None = payload.player
         if not player:
             return
 
+        changed_at = time.perf_counter()
+
+        self.prefetch_next(player)
+
         is_recommended = payload.original and payload.original.recommended
 
         if player.autoplay == wavelink.AutoPlayMode.enabled and is_recommended:
             payload.track.ctx = player.ctx
             player.current.ctx = player.ctx
             self.bot.create_task(
-                self.send_info_message(player.ctx, payload.track, is_recommended)
+                self.send_info_message(
+                    player.ctx, payload.track, is_recommended, changed_at=changed_at
+                )
             )
+        elif getattr(player.current, "resolved_late", False):
+            # a playlist entry that was still a placeholder when the previous track ended
+            if player.current.source != "flowery-tts":
+                self.bot.create_task(
+                    self.send_info_message(
+                        player.ctx, player.current, changed_at=changed_at
+                    )
+                )
 
     @commands.Cog.listener()
     async def on_voice_state_update(
@@ -197,7 +253,7 @@ class Music(commands.Cog):
                 return False
         else:
             await asyncio.gather(
-                ctx.author.voice.channel.connect(self_deaf=True, cls=wavelink.Player),  # type: ignore
+                ctx.author.voice.channel.connect(self_deaf=True, cls=CritPlayer),  # type: ignore
                 ctx.send(
                     self.t(
                         "cmd",
@@ -208,9 +264,10 @@ class Music(commands.Cog):
                 ),  # type: ignore
             )
 
-            await self.bot.wavelink_node.send(
+            node = cast(CritPlayer, ctx.voice_client).node
+            await node.send(
                 "PUT",
-                path=f"v4/sessions/{self.bot.wavelink_node.session_id}/players/{ctx.guild.id}/sponsorblock/categories",
+                path=f"v4/sessions/{node.session_id}/players/{ctx.guild.id}/sponsorblock/categories",
                 data=self.bot.sponsorblock_cache[ctx.guild.id].active_categories,
             )
         return True
@@ -220,15 +277,6 @@ class Music(commands.Cog):
         num_hash = int((progress / total) * length)
         return "⎯" * num_hash + ":radio_button:" + "⎯" * (length - num_hash - 1)
 
-    @staticmethod
-    def put_playlist_at_beginning(
-        player: wavelink.Player, playlist: wavelink.Playlist
-    ) -> None:
-        length = len(playlist)
-
-        for i in range(length - 1, -1, -1):
-            player.queue.put_at(0, playlist[i])
-
     @staticmethod
     def human_format(num: int) -> str:
         if not isinstance(num, int):
@@ -257,13 +305,75 @@ class Music(commands.Cog):
             return dislikes["dislikes"]
 
     async def get_track_info(self, track: wavelink.Playable) -> dict[str, str] | None:
+        """Get the extra info of a track (views, likes, monthly listeners, etc.) from the track info cache.
+
+        Args:
+            track (wavelink.Playable): The track.
+
+        Returns:
+            dict[str, str] | None: The track info or None if the source is not supported.
+        """
+        if track.source not in ("youtube", "spotify", "soundcloud"):
+            return None
+
+        try:
+            return await self.bot.track_info_cache.get(
+                track.source, track.identifier, lambda: self.fetch_track_info(track)
+            )
+        except Exception as e:
+            # yt-dlp's DownloadError, a dead worker, an HTTP error, ... the embed is sent without the info
+            self.log(30, f"Couldn't get the info of {track.uri}: {e!r}")
+            return None
+
+    def get_cached_track_info(self, track: wavelink.Playable) -> Optional[TrackInfoEntry]:
+        """The info of a track if it's in the memory tier of the track info cache, without awaiting anything."""
+        if track.source not in ("youtube", "spotify", "soundcloud"):
+            return None
+
+        return self.bot.track_info_cache.get_memory(
+            track.source, track.identifier, lambda: self.fetch_track_info(track)
+        )
+
+    def prefetch_next(self, player: CritPlayer, count: int = 2) -> None:
+        """Starts getting the info of the next tracks in the queue so their "now playing" embed is ready as soon as they start.
+        Prefetches of tracks that are no longer up next (e.g. after a shuffle) are cancelled.
+
+        Args:
+            player (CritPlayer): The player.
+            count (int, optional): How many of the next tracks to prefetch. Defaults to 2.
+        """
+        if player.needs_resolving:
+            self.bot.create_task(self.resolve_and_prefetch(player, count))
+
+        upcoming = {
+            track.encoded: track
+            for track in player.queue[:count]
+            if isinstance(track, wavelink.Playable) and track.source != "flowery-tts"
+        }
+
+        for encoded in player.prefetches.keys() - upcoming.keys():
+            player.prefetches.pop(encoded).cancel()
+
+        for encoded, track in upcoming.items():
+            if encoded not in player.prefetches:
+                player.prefetches[encoded] = self.bot.loop.create_task(
+                    self.get_track_info(track)
+                )
+
+    async def resolve_and_prefetch(self, player: CritPlayer, count: int = 2) -> None:
+        """Decodes the playlist placeholders that are up next, then prefetches their info."""
+        await player.resolve_ahead()
+        if not player.needs_resolving:
+            self.prefetch_next(player, count)
+
+    async def fetch_track_info(self, track: wavelink.Playable) -> dict[str, str] | None:
         match track.source:
             case "youtube":
                 dislikes_task = self.bot.loop.create_task(
                     self.get_dislikes(track.identifier)
                 )
-                info = await self.bot.loop.run_in_executor(
-                    None, self.ytdlp_extract.extract_info, track.identifier, False
+                info = await self.ytdlp.extract.run(
+                    "extract_info", track.identifier, False
                 )
 
                 view_count = self.human_format(info.get("view_count", "N/A"))
@@ -301,14 +411,14 @@ class Music(commands.Cog):
 
                 return {
                     "monthly_listeners": monthly_listeners,
-                    "playcount": self.human_format(int(playcount)),
+                    "playcount": self.human_format(
+                        int(playcount) if playcount.isdigit() else playcount
+                    ),
                     "release_date": release_date,
                     "explicit": explicit,
                 }
             case "soundcloud":
-                info = await self.bot.loop.run_in_executor(
-                    None, self.ytdlp_extract.extract_info, track.uri, False
-                )
+                info = await self.ytdlp.extract.run("extract_info", track.uri, False)
 
                 playcount = self.human_format(info.get("view_count", "N/A"))
                 likes = self.human_format(info.get("like_count", "N/A"))
@@ -335,9 +445,17 @@ class Music(commands.Cog):
         ctx: commands.Context,
         track: wavelink.Playable,
         is_recommended: bool = False,
+        *,
+        changed_at: float,
     ) -> None:
-        info = self.bot.loop.create_task(self.get_track_info(track))
+        """Sends the "now playing" message, with the track info if it's already there or edited in once it arrives.
 
+        Args:
+            ctx (commands.Context): Where to send it.
+            track (wavelink.Playable): The track.
+            is_recommended (bool, optional): If the track was recommended by autoplay. Defaults to False.
+            changed_at (float): The `time.perf_counter()` of the track change (the command or the track event).
+        """
         if track.source == "flowery-tts":
             self.bot.create_task(
                 ctx.send(
@@ -353,6 +471,68 @@ class Music(commands.Cog):
             )
             return
 
+        player = cast(CritPlayer, ctx.voice_client)
+        info = player.prefetches.pop(track.encoded, None) if player else None
+        if info is None:
+            cached = self.get_cached_track_info(track)
+            if cached is not None:  # memory cache hit, the full embed is sent once
+                await ctx.send(
+                    embed=self.build_info_embed(track, cached.info, is_recommended)
+                )
+                self.record_first_response(track, changed_at, "full")
+                return
+            info = self.bot.loop.create_task(self.get_track_info(track))
+
+        if info.done():  # the prefetch already finished
+            await ctx.send(
+                embed=self.build_info_embed(track, info.result(), is_recommended)
+            )
+            self.record_first_response(track, changed_at, "full")
+            return
+
+        # send what wavelink already gave us and fill in the rest when it arrives
+        msg = await ctx.send(embed=self.build_info_embed(track, None, is_recommended))
+        self.record_first_response(track, changed_at, "partial")
+
+        try:
+            info = await asyncio.wait_for(info, timeout=self.enrich_deadline)
+        except asyncio.TimeoutError:
+            self.enrich_timeouts += 1
+            return
+
+        if info:
+            await msg.edit(embed=self.build_info_embed(track, info, is_recommended))
+
+    def record_first_response(
+        self, track: wavelink.Playable, changed_at: float, embed: str
+    ) -> None:
+        """Records the time between the track changing and the "now playing" message being sent.
+
+        `embed` is "full" when the track info was already there and "partial" when it's edited in later.
+        """
+        self.bot.metrics.observe(
+            "critbot_now_playing_seconds",
+            time.perf_counter() - changed_at,
+            source=track.source,
+            embed=embed,
+        )
+
+    def build_info_embed(
+        self,
+        track: wavelink.Playable,
+        info: dict[str, str] | None,
+        is_recommended: bool = False,
+    ) -> discord.Embed:
+        """Builds the "now playing" embed. Without `info` only the fields already in the track are shown.
+
+        Args:
+            track (wavelink.Playable): The track.
+            info (dict[str, str] | None): The track info from `get_track_info`.
+            is_recommended (bool, optional): If the track was recommended by autoplay. Defaults to False.
+
+        Returns:
+            discord.Embed: The embed.
+        """
         track_length = self.parse_duration(track.length)
         embed = discord.Embed(
             title=self.t(
@@ -376,44 +556,36 @@ class Music(commands.Cog):
             icon_url=track.ctx.author.avatar.url,
         )
 
-        info = await info
-
+        footer = []
         if info:
-            if is_recommended:
-                text = (
-                    self.t(
-                        "embed",
-                        "footer",
-                        upload_date=info.get("release_date", "N/A"),
-                        mcog_name="music",
-                        mcommand_name="play",
-                    )
-                    + " | "
-                    + self.t(
-                        "embed",
-                        "recommended",
-                        source=track.source.capitalize(),
-                        mcog_name="music",
-                        mcommand_name="play",
-                    )
-                )
-            else:
-                text = self.t(
+            footer.append(
+                self.t(
                     "embed",
                     "footer",
                     upload_date=info.get("release_date", "N/A"),
                     mcog_name="music",
                     mcommand_name="play",
                 )
-
-            embed.set_footer(text=text)
+            )
+        if is_recommended:
+            footer.append(
+                self.t(
+                    "embed",
+                    "recommended",
+                    source=track.source.capitalize(),
+                    mcog_name="music",
+                    mcommand_name="play",
+                )
+            )
+        if footer:
+            embed.set_footer(text=" | ".join(footer))
 
         embed.add_field(
             name=self.t("embed", "duration", mcog_name="music", mcommand_name="play"),
             value=track_length,
         )
 
-        if track.source == "youtube" or track.source == "soundcloud":
+        if info and (track.source == "youtube" or track.source == "soundcloud"):
             track.artist.url = info[
                 "uploader_url"
             ]  # for some reason lavalink doesn't set the artist url
@@ -430,81 +602,85 @@ class Music(commands.Cog):
                 "embed", "click", url=track.uri, mcog_name="music", mcommand_name="play"
             ),
         )
-        match track.source:
-            case "youtube":
-                embed.add_field(
-                    name=self.t(
-                        "embed", "views", mcog_name="music", mcommand_name="play"
-                    ),
-                    value=info["view_count"],
-                )
-                embed.add_field(
-                    name="Likes / Dislikes",
-                    value=f"{info["like_count"]} 👍 / {info["dislike_count"]} 👎",
-                )
-                embed.add_field(
-                    name=self.t(
-                        "embed", "subs", mcog_name="music", mcommand_name="play"
-                    ),
-                    value=info["subs"],
-                )
-            case "spotify":
-                embed.add_field(
-                    name=self.t(
-                        "embed",
-                        "monthly_listeners",
-                        mcog_name="music",
-                        mcommand_name="play",
-                    ),
-                    value=info["monthly_listeners"],
-                )
-                embed.add_field(
-                    name=self.t(
-                        "embed", "playcount", mcog_name="music", mcommand_name="play"
-                    ),
-                    value=info["playcount"],
-                )
-                embed.add_field(
-                    name=self.t(
-                        "embed", "explicit", mcog_name="music", mcommand_name="play"
-                    ),
-                    value=self.t(
-                        "embed", "yes", mcog_name="music", mcommand_name="play"
+        if info:
+            match track.source:
+                case "youtube":
+                    embed.add_field(
+                        name=self.t(
+                            "embed", "views", mcog_name="music", mcommand_name="play"
+                        ),
+                        value=info["view_count"],
+                    )
+                    embed.add_field(
+                        name="Likes / Dislikes",
+                        value=f"{info["like_count"]} 👍 / {info["dislike_count"]} 👎",
+                    )
+                    embed.add_field(
+                        name=self.t(
+                            "embed", "subs", mcog_name="music", mcommand_name="play"
+                        ),
+                        value=info["subs"],
+                    )
+                case "spotify":
+                    embed.add_field(
+                        name=self.t(
+                            "embed",
+                            "monthly_listeners",
+                            mcog_name="music",
+                            mcommand_name="play",
+                        ),
+                        value=info["monthly_listeners"],
+                    )
+                    embed.add_field(
+                        name=self.t(
+                            "embed", "playcount", mcog_name="music", mcommand_name="play"
+                        ),
+                        value=info["playcount"],
+                    )
+                    embed.add_field(
+                        name=self.t(
+                            "embed", "explicit", mcog_name="music", mcommand_name="play"
+                        ),
+                        value=self.t(
+                            "embed", "yes", mcog_name="music", mcommand_name="play"
+                        )
+                        if info["explicit"]
+                        else self.t("embed", "no", mcog_name="music", mcommand_name="play"),
+                    )
+                case "soundcloud":
+                    embed.add_field(
+                        name=self.t(
+                            "embed", "playcount", mcog_name="music", mcommand_name="play"
+                        ),
+                        value=info["playcount"],
+                    )
+                    embed.add_field(
+                        name="Likes",
+                        value=info["likes"],
+                    )
+                    embed.add_field(
+                        name=self.t(
+                            "embed", "reposts", mcog_name="music", mcommand_name="play"
+                        ),
+                        value=info["reposts"],
                     )
-                    if info["explicit"]
-                    else self.t("embed", "no", mcog_name="music", mcommand_name="play"),
-                )
-            case "soundcloud":
-                embed.add_field(
-                    name=self.t(
-                        "embed", "playcount", mcog_name="music", mcommand_name="play"
-                    ),
-                    value=info["playcount"],
-                )
-                embed.add_field(
-                    name="Likes",
-                    value=info["likes"],
-                )
-                embed.add_field(
-                    name=self.t(
-                        "embed", "reposts", mcog_name="music", mcommand_name="play"
-                    ),
-                    value=info["reposts"],
-                )
 
-        self.bot.create_task(ctx.send(embed=embed))
+        return embed
 
     async def play_logic(
         self, ctx: commands.Context, query: str, play_next: bool
     ) -> None:
+        changed_at = time.perf_counter()
         if not await self.ensure_voice(ctx):
             return
 
         query = query.strip("<>")
 
-        tracks: wavelink.Search = await wavelink.Playable.search(query)
+        tracks: wavelink.Search | LazyPlaylist = await self.bot.search_cache.search(
+            query, lazy=True
+        )
 
-        player = cast(wavelink.Player, ctx.voice_client)
+        player = cast(CritPlayer, ctx.voice_client)
         player.ctx = ctx
 
         if not tracks:
@@ -513,7 +689,7 @@ class Music(commands.Cog):
             )
             return
 
-        if isinstance(tracks, wavelink.Playlist):
+        if isinstance(tracks, LazyPlaylist):
             self.bot.create_task(
                 ctx.send(
                     self.t(
@@ -524,28 +700,35 @@ class Music(commands.Cog):
                     )
                 )
             )
-            for track in tracks:
-                track.ctx = ctx
-                track.first_playing = False
-
+            # only the track that starts now is built, the rest are queued as placeholders straight from
+            # the Lavalink response and resolved a few at a time ahead of playback by the player
             if not player.playing:
-                tracks[0].first_playing = True
-                self.bot.create_task(player.play(tracks[0], volume=30))
-                self.bot.create_task(player.queue.put_wait(tracks[1:]))
-                self.bot.create_task(self.send_info_message(ctx, tracks[0]))
+                first = tracks.playable(0)
+                first.ctx = ctx
+                first.first_playing = True
+                entries = tracks.entries(1, ctx)
+                self.bot.create_task(player.play(first, volume=30))
+                player.queue.put_many_at(len(player.queue), entries)
+                self.bot.create_task(
+                    self.send_info_message(ctx, first, changed_at=changed_at)
+                )
 
             else:
+                entries = tracks.entries(ctx=ctx)
                 if play_next:
-                    self.put_playlist_at_beginning(player, tracks)
+                    player.queue.put_many_at(0, entries)
                 else:
-                    self.bot.create_task(player.queue.put_wait(tracks))
+                    player.queue.put_many_at(len(player.queue), entries)
+                self.prefetch_next(player)
 
         else:
             tracks[0].ctx = ctx
             tracks[0].first_playing = not player.playing
             if not player.playing:
                 self.bot.create_task(player.play(tracks[0], volume=30))
-                self.bot.create_task(self.send_info_message(ctx, tracks[0]))
+                self.bot.create_task(
+                    self.send_info_message(ctx, tracks[0], changed_at=changed_at)
+                )
             else:
                 self.bot.create_task(
                     ctx.send(
@@ -560,9 +743,8 @@ class Music(commands.Cog):
                 if play_next:
                     player.queue.put_at(0, tracks[0])
                 else:
-                    self.bot.create_task(
-                        player.queue.put_wait(tracks[0]),
-                    )
+                    player.queue.put(tracks[0])
+                self.prefetch_next(player)
 
     @commands.hybrid_command(aliases=["p"])
     async def play(self, ctx: commands.Context, *, query: str) -> None:
@@ -600,35 +782,27 @@ class Music(commands.Cog):
             player.autoplay = wavelink.AutoPlayMode.disabled
             await ctx.send(self.t("cmd", "disabled"))
 
-    def _estimate_time_until(
-        self, track: wavelink.Playable, player: wavelink.Player
-    ) -> str:
-        """Get the estimated until the given track is played.
+    def _estimate_time_until(self, index: int, player: CritPlayer) -> str:
+        """Get the estimated time until the track at the given queue position is played.
 
         Args:
-            track (wavelink.Playable): The track to estimate the time until.
-            player (wavelink.Player): The player to get the current position.
+            index (int): The position of the track in the queue.
+            player (CritPlayer): The player to get the current position.
 
         Returns:
             str: The estimated time until the track is played.
         """
 
-        track_index = player.queue.index(track)
-        total_time = 0
-        for i in range(track_index):
-            if player.queue[i].is_stream:
-                total_time += 0
-            else:
-                total_time += player.queue[i].length
+        total_time = player.queue.time_until(index)
 
-        if player.playing:
+        if player.playing and not player.current.is_stream:
             total_time += player.current.length - player.position
 
-        return self.parse_duration(total_time)
+        return self.parse_duration(total_time / player.playback_speed)
 
     @commands.hybrid_command(aliases=["q", "fila"])
     async def queue(self, ctx: commands.Context) -> None:
-        player = cast(wavelink.Player, ctx.voice_client)
+        player = cast(CritPlayer, ctx.voice_client)
         if not player:
             self.bot.create_task(ctx.reply(self.t("not_in_voice")))
             return
@@ -655,46 +829,49 @@ class Music(commands.Cog):
             self.bot.create_task(ctx.send(embed=embed))
             return
 
-        embeds = []
-        j = 0
-        embed = None
-        for i, track in enumerate(player.queue):
-            if j == 0:  # reset embed
-                embed = discord.Embed(
-                    description=self.t(
-                        "embed",
-                        "description",
-                        track=player.current.title,
-                        user=player.ctx.author,
-                        current_time=self.parse_duration(player.position),
-                        total_time=self.parse_duration(player.current.length)
-                        if not player.current.is_stream
-                        else "N/A",
-                    )
-                )
-                embed.set_author(
-                    icon_url=ctx.author.avatar.url, name=self.t("embed", "title")
-                )
+        tracks_per_page = 9
 
-            if track.is_stream:
-                length_and_estimated = (
-                    f"N/A / Est. {self._estimate_time_until(track, player)}"
+        async def render_page(page: int) -> discord.Embed | None:
+            # pages are only rendered when viewed, so the translations can't rely on the global command check
+            start = page * tracks_per_page
+            tracks = player.queue[start : start + tracks_per_page]
+            if not tracks or not player.current:
+                return None
+
+            embed = discord.Embed(
+                description=self.t(
+                    "embed",
+                    "description",
+                    track=player.current.title,
+                    user=player.ctx.author,
+                    current_time=self.parse_duration(player.position),
+                    total_time=self.parse_duration(player.current.length)
+                    if not player.current.is_stream
+                    else "N/A",
+                    ctx=ctx,
                 )
-            else:
-                length_and_estimated = f"{self.parse_duration(track.length)} / Est. {self._estimate_time_until(track, player)}"
+            )
+            embed.set_author(
+                icon_url=ctx.author.avatar.url, name=self.t("embed", "title", ctx=ctx)
+            )
 
-            embed.add_field(name=f"{i+1}. {track.title}", value=length_and_estimated)
+            for i, track in enumerate(tracks, start):
+                if track.is_stream:
+                    length_and_estimated = (
+                        f"N/A / Est. {self._estimate_time_until(i, player)}"
+                    )
+                else:
+                    length_and_estimated = f"{self.parse_duration(track.length)} / Est. {self._estimate_time_until(i, player)}"
 
-            if j >= 8:
-                embeds.append(embed)
-                j = 0
-                continue
+                embed.add_field(name=f"{i+1}. {track.title}", value=length_and_estimated)
 
-            if i == len(player.queue) - 1:
-                embeds.append(embed)
-            j += 1
+            return embed
 
-        await Paginator.Simple(ephemeral=True).start(ctx, pages=embeds)
+        await Paginator.Simple(ephemeral=True).start(
+            ctx,
+            source=render_page,
+            total=math.ceil(len(player.queue) / tracks_per_page),
+        )
 
     @commands.hybrid_command(aliases=["s"])
     async def skip(self, ctx: commands.Context) -> None:
@@ -736,16 +913,16 @@ class Music(commands.Cog):
         else:
             await ctx.send(self.t("err", "not_paused"))
 
-    @staticmethod
-    async def stop_logic(player: wavelink.Player) -> None:
+    async def stop_logic(self, player: CritPlayer) -> None:
         player.queue.clear()
         player.autoplay = wavelink.AutoPlayMode.disabled
         player.auto_queue.clear()
+        self.prefetch_next(player)  # cancels the prefetches of the cleared queue
         await player.stop()
 
     @commands.hybrid_command(aliases=["para"])
     async def stop(self, ctx: commands.Context) -> None:
-        player = cast(wavelink.Player, ctx.voice_client)
+        player = cast(CritPlayer, ctx.voice_client)
         if not player:
             await ctx.send(self.t("not_in_voice"))
             return
@@ -775,7 +952,7 @@ class Music(commands.Cog):
 
     @commands.hybrid_command(aliases=["embaralhar", "misturar"])
     async def shuffle(self, ctx: commands.Context) -> None:
-        player = cast(wavelink.Player, ctx.voice_client)
+        player = cast(CritPlayer, ctx.voice_client)
         if not player:
             await ctx.reply(self.t("not_in_voice"))
             return
@@ -787,6 +964,7 @@ class Music(commands.Cog):
             return
 
         player.queue.shuffle()
+        self.prefetch_next(player)
         await ctx.send(self.t("cmd", "output"))
 
     @staticmethod
@@ -972,7 +1150,7 @@ class Music(commands.Cog):
             return
 
         player = cast(wavelink.Player, ctx.voice_client)
-        tracks: wavelink.Search = await wavelink.Playable.search(
+        tracks: wavelink.Search = await self.bot.search_cache.search(
             "ftts://" + text + "?voice=" + voice
         )  # flower tts
         track = tracks[0]
@@ -1043,93 +1221,185 @@ class Music(commands.Cog):
         else:
             await ctx.send(self.t("cmd", "volume", volume=player.volume))
 
-    @staticmethod
-    def get_expected_file_size(duration: int) -> int:
-        return duration * ((320 * 1000) // 8)
-
-    @staticmethod
-    def get_tmp_size() -> int:
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk("/tmp"):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                # skip if it is symbolic link
-                if not os.path.islink(fp):
-                    total_size += os.path.getsize(fp)
-
-        return total_size
-
     @commands.hybrid_command(aliases=["transferir", "dl"])
     async def download(self, ctx: commands.Context, *, query: str) -> None:
         query = query.strip("<>")
 
-        # download with info
+        # extract once, the download reuses the formats selected here instead of resolving the query again
         msg: discord.Message
         async with ctx.typing():
-            info, msg = await asyncio.gather(
-                self.bot.loop.run_in_executor(
-                    None, self.ytdlp_download.extract_info, query, False
-                ),
-                ctx.send(self.t("cmd", "checking")),
-            )
+            msg = await ctx.send(self.t("cmd", "checking"))
+            try:
+                info = await self.ytdlp.download.run("extract_info", query, False)
+            except YtdlpQueueFull:
+                self.bot.create_task(
+                    msg.edit(content=self.t("err", "too_many_downloads"))
+                )
+                return
+            except asyncio.TimeoutError:
+                self.bot.create_task(msg.edit(content=self.t("err", "timed_out")))
+                return
 
             # check for query
-            if "entries" in info:
-                info = info["entries"][0]
+            if info and "entries" in info:
+                info = next(iter(info["entries"]), None)
 
-            # check if the file is bigger than 25MB
-            # TODO: This can mostly be removed, we can just check if the duration is bigger than 660 seconds (11 minutes aprox. 25MB)
-            if self.get_expected_file_size(info["duration"]) > 25 * 1024 * 1024:
+            if not info:
+                self.bot.create_task(msg.edit(content=self.t("err", "failed")))
+                return
+
+            if not info.get("duration"):  # e.g. a live stream
+                self.bot.create_task(msg.edit(content=self.t("err", "failed")))
+                return
+
+            # copy an audio only format that fits in 25MB as is, or transcode at the best bitrate that fits
+            plan = plan_download(
+                info,
+                self.max_download_size,
+                self.max_download_bitrate,
+                seekable=not self.downloads.in_memory,
+            )
+            if plan is None:
                 self.bot.create_task(msg.edit(content=self.t("err", "file_too_big")))
                 return
 
-            # check if the /tmp folder is bigger than 1GB, if it is, wait 5 seconds and try again
-            if self.get_tmp_size() > 1024 * 1024 * 1024:
-                total_time = 0
-                await msg.edit(
-                    content=self.t("cmd", "too_many_downloads", time=total_time)
+            title = info["title"].replace("/", "_")
+            file_name = f"{title}.{plan.codec}"
+            try:
+                if self.downloads.in_memory:
+                    await self.send_in_memory(ctx, info, plan, msg, file_name)
+                else:
+                    await self.send_cached(ctx, info, plan, msg, file_name)
+            except (DownloadError, TranscodeFailed):
+                self.bot.create_task(msg.edit(content=self.t("err", "failed")))
+                return
+            except TranscodeTooBig:
+                self.bot.create_task(msg.edit(content=self.t("err", "file_too_big")))
+                return
+            except (YtdlpQueueFull, DownloadWorkspaceFull):
+                self.bot.create_task(
+                    msg.edit(content=self.t("err", "too_many_downloads"))
                 )
-                while self.get_tmp_size() > 1024 * 1024 * 1024:
-                    await asyncio.sleep(5)
-                    await msg.edit(
-                        content=self.t("cmd", "too_many_downloads", time=total_time)
+                return
+            except asyncio.TimeoutError:
+                self.bot.create_task(msg.edit(content=self.t("err", "timed_out")))
+                return
+
+            self.bot.create_task(
+                msg.edit(
+                    content=self.t(
+                        "cmd", "finished", title=info["title"], author=info["uploader"]
                     )
-                    total_time += 5
-                    if total_time > 60:
-                        self.bot.create_task(
-                            msg.edit(content=self.t("err", "too_many_downloads"))
-                        )
-                        return
+                )
+            )
 
-            # download the file
-            await asyncio.gather(
-                self.bot.loop.run_in_executor(
-                    None, self.ytdlp_download.download, [query]
+    async def send_cached(
+        self,
+        ctx: commands.Context,
+        info: dict,
+        plan: DownloadPlan,
+        msg: discord.Message,
+        file_name: str,
+    ) -> None:
+        # the transcoded files are cached, so the same video is only downloaded once
+        key = TranscodeKey(
+            info["extractor_key"], str(info["id"]), plan.codec, plan.quality
+        )
+        path = await self.transcodes.get(
+            key, lambda: self.download_and_transcode(info, plan, msg)
+        )
+
+        # discord.File opens the file right away, so it can be evicted from the cache while it's being sent
+        file = discord.File(path, filename=file_name)
+        self.bot.create_task(msg.edit(content=self.t("cmd", "sending")))
+        await ctx.send(file=file)
+
+    async def send_in_memory(
+        self,
+        ctx: commands.Context,
+        info: dict,
+        plan: DownloadPlan,
+        msg: discord.Message,
+        file_name: str,
+    ) -> None:
+        """Transcode (or copy) the planned format with ffmpeg into memory and upload it from there, nothing touches the disk.
+
+        The workspace budget limits the memory held by the buffers instead of the disk space.
+        """
+        source = plan.format or info  # when transcoding, the format yt-dlp selected
+        if "url" not in source:  # e.g. a format that has to be merged from several
+            raise DownloadError(f"No single format url for {info.get('webpage_url')}")
+
+        reservation = await self.reserve_download_space(plan, msg)
+        with reservation:
+            self.bot.create_task(msg.edit(content=self.t("cmd", "downloading")))
+            buffer = await asyncio.wait_for(
+                transcode_to_memory(
+                    source["url"],
+                    plan.ffmpeg_args(),
+                    self.max_download_size,
+                    headers=source.get("http_headers"),
                 ),
-                msg.edit(content=self.t("cmd", "downloading")),
+                self.ytdlp.download.timeout,
             )
 
             self.bot.create_task(msg.edit(content=self.t("cmd", "sending")))
+            await ctx.send(file=discord.File(buffer, filename=file_name))
+
+    async def reserve_download_space(
+        self, plan: DownloadPlan, msg: discord.Message
+    ) -> DownloadReservation:
+        # reserve the space the file will take in the workspace, waiting in line if it's full
+        expected_size = plan.expected_size
+        reservation = self.downloads.reserve_nowait(expected_size)
+        if reservation is None:
+            await msg.edit(
+                content=self.t(
+                    "cmd",
+                    "too_many_downloads",
+                    position=self.downloads.position(expected_size),
+                )
+            )
+            reservation = await self.downloads.reserve(
+                expected_size, timeout=self.download_wait_timeout
+            )
+        return reservation
 
-            # get the file name
-            file_name = self.ytdlp_download.prepare_filename(info)
+    async def download_and_transcode(
+        self, info: dict, plan: DownloadPlan, msg: discord.Message
+    ) -> str:
+        """Download and transcode a track into the download workspace, for the transcode cache.
 
-            # change whatever extension is to .mp3
-            last_dot_index = file_name.rfind(".")
-            file_extension = file_name[last_dot_index:]
-            file_name = file_name.replace(file_extension, ".mp3")
+        Args:
+            info (dict): The track info extracted by the download workers.
+            plan (DownloadPlan): Which format to download and how to convert it.
+            msg (discord.Message): The status message of the request that started the download.
 
-            # send the file
-            self.bot.create_task(ctx.send(file=discord.File(file_name)))
+        Raises:
+            DownloadError: If yt-dlp didn't produce a file.
+            DownloadWorkspaceFull: If there was no space in the workspace in time.
+            YtdlpQueueFull: If the download workers are too busy.
+            asyncio.TimeoutError: If the download took too long.
 
-            self.bot.create_task(
-                msg.edit(
-                    content=self.t(
-                        "cmd", "finished", title=info["title"], author=info["uploader"]
-                    )
-                )
+        Returns:
+            str: The path of the transcoded file.
+        """
+        reservation = await self.reserve_download_space(plan, msg)
+
+        # the space is released once the file is moved into the cache, which has its own budget
+        with reservation:
+            result, _ = await asyncio.gather(
+                self.ytdlp.download.run(
+                    "process_ie_result", info, True, overrides=plan.ytdlp_overrides
+                ),
+                msg.edit(content=self.t("cmd", "downloading")),
             )
-            self.bot.create_task(aiofiles.os.remove(file_name))
+
+            # the post processors leave the path of the final (transcoded) file in the result
+            downloads = (result or {}).get("requested_downloads") or []
+            if not downloads or "filepath" not in downloads[-1]:
+                raise DownloadError(f"yt-dlp didn't download {info.get('webpage_url')}")
+            return downloads[-1]["filepath"]
 
     # TODO: actually implement this
     @commands.hybrid_command(
@@ -1206,10 +1476,134 @@ class Music(commands.Cog):
         embed.set_thumbnail(url=track.artwork)
         await ctx.send(embed=embed)
 
+    @property
+    def players(self) -> list[CritPlayer]:
+        return [vc for vc in self.bot.voice_clients if isinstance(vc, CritPlayer)]
+
+    @tasks.loop(seconds=30)
+    async def save_players(self) -> None:
+        """Snapshot every player, so a restart (or a crash) can pick up where they were."""
+        try:
+            await self.bot.player_states.save(self.players)
+        except Exception as e:
+            self.log(40, f"Failed to save the player states: {e!r}")
+
+    async def restore_players(self) -> None:
+        """Rebuild the players saved before the last shutdown."""
+        await self.bot.wait_until_ready()
+        try:
+            snapshots = await self.bot.player_states.load()
+        finally:
+            # only saved once loaded, the first save would overwrite them
+            self.save_players.start()
+        if not snapshots:
+            return
+
+        results = await asyncio.gather(
+            *(self.restore_player(snapshot) for snapshot in snapshots),
+            return_exceptions=True,
+        )
+        for snapshot, result in zip(snapshots, results):
+            if isinstance(result, BaseException):
+                self.log(
+                    40, f"Failed to restore the player of {snapshot.guild_id}: {result!r}"
+                )
+
+        restored = sum(result is True for result in results)
+        self.log(20, f"Restored {restored}/{len(snapshots)} players")
+
+    async def restore_player(self, snapshot: PlayerSnapshot) -> bool:
+        guild = self.bot.get_guild(snapshot.guild_id)
+        if guild is None or guild.voice_client is not None:
+            return False
+
+        channel = guild.get_channel(snapshot.voice_channel_id)
+        text_channel = guild.get_channel_or_thread(snapshot.text_channel_id)
+        if (
+            not isinstance(channel, discord.VoiceChannel | discord.StageChannel)
+            or text_channel is None
+            or not any(not member.bot for member in channel.members)
+        ):
+            return False
+
+        # the requester of the tracks is the author of the last command, the context is rebuilt from its message
+        try:
+            message = await text_channel.fetch_message(snapshot.message_id)  # type: ignore
+        except discord.HTTPException:
+            return False
+        ctx = await self.bot.get_context(message)
+
+        # the saved node still has the player if its session was resumed
+        node = wavelink.Pool.nodes.get(snapshot.node)
+        nodes = [node] if node and node.status is wavelink.NodeStatus.CONNECTED else None
+        player = await channel.connect(
+            self_deaf=True, cls=functools.partial(CritPlayer, nodes=nodes)  # type: ignore
+        )
+        player.ctx = ctx
+        player.autoplay = wavelink.AutoPlayMode(snapshot.autoplay)
+        player.queue.mode = wavelink.QueueMode(snapshot.queue_mode)
+
+        node = player.node
+        await node.send(
+            "PUT",
+            path=f"v4/sessions/{node.session_id}/players/{guild.id}/sponsorblock/categories",
+            data=self.bot.sponsorblock_cache[guild.id].active_categories,
+        )
+
+        # one request decodes the whole queue, the entries are resolved again when they come up
+        encoded = ([snapshot.current] if snapshot.current else []) + snapshot.queue
+        data = await node.send("POST", path="v4/decodetracks", data=encoded) if encoded else []
+
+        current = wavelink.Playable(data.pop(0)) if snapshot.current and data else None
+        if data:
+            player.queue.put_many_at(
+                0, [PlaylistEntry.from_data(track, ctx) for track in data]
+            )
+
+        filters = wavelink.Filters(data=snapshot.filters)
+        if current is None:
+            await asyncio.gather(player.set_volume(snapshot.volume), player.set_filters(filters))
+            return True
+
+        position = snapshot.position
+        if node.identifier == snapshot.node:
+            # a resumed session kept playing while the bot was down, continue from where it is now
+            try:
+                info = await node.fetch_player_info(guild.id)
+            except (wavelink.LavalinkException, wavelink.NodeException):
+                info = None
+            if info is not None and info.track is not None and info.track.encoded == current.encoded:
+                position = info.state.position
+
+        current.ctx = ctx
+        current.first_playing = False
+        await player.play(
+            current,
+            start=position,
+            paused=snapshot.paused,
+            volume=snapshot.volume,
+            filters=filters,
+        )
+        return True
+
     async def cog_load(self) -> None:
+        if self.bot.is_ready():  # the cog was reloaded, its players are still there
+            self.save_players.start()
+        else:
+            self.bot.create_task(self.restore_players())
         print("Loaded {name} cog!".format(name=self.__class__.__name__))
 
     async def cog_unload(self) -> None:
+        # the bot unloads its cogs before closing the voice connections, so this is the state at shutdown
+        if self.save_players.is_running():  # not before the saved players were restored
+            self.save_players.cancel()
+            await self.save_players()
+        if self.bot.shutting_down and not self.bot.owns_lavalink:
+            # keep them alive on Lavalink for the restarted bot instead of letting close() destroy them
+            # (a Lavalink started by the launcher is stopped with the bot, they are replayed from the snapshot instead)
+            for player in self.players:
+                player.detach()
+        self.ytdlp.shutdown()
         print("Unloaded {name} cog!".format(name=self.__class__.__name__))
 
 
@@ -1,24 +1,29 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
+import hashlib
 import logging
 import os
+import re
+import signal
 import subprocess
+import time
 from dataclasses import dataclass
 from argparse import ArgumentParser
-from time import sleep
 
 import asyncpg
 import aiofiles
 import aiofiles.os
 import discord
 import uvloop
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession, ClientTimeout
 from colorlog import ColoredFormatter
 from discord import app_commands
 from discord.ext import commands
 
 from bot import CritBot
+from Utils import Metrics
 from config import data
 from i18n import I18n
 
@@ -38,7 +43,101 @@ class Colors:
     reset: str = "\033[0m"
 
 
-async def start_bot(dev: bool) -> None:
+# any constant works, it just has to be the same for every process of the bot
+MIGRATIONS_LOCK_ID = 0x637269742D6D6967  # "crit-mig"
+MIGRATION_FILE = re.compile(r"V(?P<version>\d+)__(?P<name>\w+)\.sql")
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    sql: str
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.sql.encode()).hexdigest()
+
+
+async def read_migrations(path: str = "./migrations") -> list[Migration]:
+    """The `V<version>__<name>.sql` files in `path`, in version order."""
+    migrations: dict[int, Migration] = {}
+    for file in await aiofiles.os.listdir(path):
+        if not (match := MIGRATION_FILE.fullmatch(file)):
+            continue
+
+        version = int(match["version"])
+        if version in migrations:
+            raise RuntimeError(f"Two migrations have the version {version}")
+
+        async with aiofiles.open(os.path.join(path, file), "r") as f:
+            migrations[version] = Migration(version, match["name"], await f.read())
+
+    return [migrations[version] for version in sorted(migrations)]
+
+
+async def applied_migrations(conn: asyncpg.Connection) -> dict[int, str]:
+    """The versions already applied and their checksums, empty if the ledger doesn't exist yet."""
+    if await conn.fetchval("SELECT to_regclass('schema_migrations');") is None:
+        return {}
+    records = await conn.fetch("SELECT version, checksum FROM schema_migrations;")
+    return {record["version"]: record["checksum"] for record in records}
+
+
+def pending_migrations(
+    migrations: list[Migration], applied: dict[int, str]
+) -> list[Migration]:
+    for migration in migrations:
+        checksum = applied.get(migration.version)
+        if checksum is not None and checksum != migration.checksum:
+            raise RuntimeError(
+                f"Migration V{migration.version}__{migration.name} was changed after being applied, add a new migration instead"
+            )
+    return [migration for migration in migrations if migration.version not in applied]
+
+
+async def apply_migrations(pool: asyncpg.Pool, logger: logging.Logger) -> None:
+    """Apply the migrations that aren't in the `schema_migrations` ledger yet, each in its own transaction.
+
+    An advisory lock makes concurrent processes apply them one at a time, the schema isn't touched when nothing is pending.
+
+    Raises:
+        RuntimeError: If an applied migration was edited or two migrations share a version.
+    """
+    migrations = await read_migrations()
+
+    async with pool.acquire() as conn:
+        if not pending_migrations(migrations, await applied_migrations(conn)):
+            return
+
+        await conn.execute("SELECT pg_advisory_lock($1);", MIGRATIONS_LOCK_ID)
+        try:
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations(
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    checksum TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+                """
+            )
+            # another process may have applied them while this one waited for the lock
+            for migration in pending_migrations(migrations, await applied_migrations(conn)):
+                async with conn.transaction():
+                    await conn.execute(migration.sql)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name, checksum) VALUES ($1, $2, $3);",
+                        migration.version,
+                        migration.name,
+                        migration.checksum,
+                    )
+                logger.log(20, f"Applied migration V{migration.version}__{migration.name}")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1);", MIGRATIONS_LOCK_ID)
+
+
+async def start_bot(dev: bool, lavalink_ready: asyncio.Task[bool]) -> None:
     if dev:
         print("Running in development mode...")
         data["dev"] = True
@@ -76,20 +175,17 @@ async def start_bot(dev: bool) -> None:
     console.setFormatter(formatter)
     logger.addHandler(console)
 
-    async with ClientSession() as our_client, asyncpg.create_pool(
-        **data["postgres"]
+    metrics = Metrics()
+    async with ClientSession(
+        trace_configs=[metrics.trace_config()]
+    ) as our_client, asyncpg.create_pool(
+        **data["postgres"], init=metrics.init_connection
     ) as pool:
         exts = [
             f"cogs.{file[:-3]}" for file in os.listdir("./cogs") if file.endswith(".py")
         ]
 
-        # Apply migrations
-        files = await aiofiles.os.listdir("./migrations")
-        for file in files:
-            async with aiofiles.open(f"./migrations/{file}", "r") as f:
-                migration = await f.read()
-                await pool.execute(migration)
-                logger.log(20, f"Applied migration {file}")
+        await apply_migrations(pool, logger)
 
         async with pool.acquire() as conn:
             prefixes_and_langs: list[asyncpg.Record] = await conn.fetch(
@@ -105,7 +201,8 @@ async def start_bot(dev: bool) -> None:
         async def get_prefix(bot, message):
             return commands.when_mentioned_or(prefixes[message.guild.id])(bot, message)
 
-        i18n = I18n(
+        i18n = await asyncio.to_thread(
+            I18n,
             data["default_language"],
             data["dev"],
             data["testing_guild_id"],
@@ -125,12 +222,38 @@ async def start_bot(dev: bool) -> None:
                     )
                 return True
 
+            async def _call(self, interaction: discord.Interaction) -> None:
+                # app commands and hybrid commands used with a slash, from invoke to completion
+                start = time.perf_counter()
+                failed = True  # also when it raised something the tree doesn't handle
+                try:
+                    await super()._call(interaction)
+                    failed = interaction.command_failed
+                finally:
+                    command = interaction.command
+                    if (
+                        interaction.type is discord.InteractionType.application_command
+                        and command is not None
+                    ):
+                        metrics.observe(
+                            "critbot_command_seconds",
+                            time.perf_counter() - start,
+                            command=command.qualified_name,
+                            cog=getattr(command.binding, "qualified_name", "")
+                            if isinstance(command, app_commands.Command)
+                            else "",
+                            outcome="error" if failed else "ok",
+                        )
+
         async with CritBot(
             i18n=i18n,
             prefixes=prefixes,
             web_client=our_client,
             initial_extensions=exts,
             db_pool=pool,
+            metrics=metrics,
+            lavalink_ready=lavalink_ready,
+            owns_lavalink=lavalink_proc is not None,
             **data,
             intents=discord.Intents.all(),
             command_prefix=get_prefix,
@@ -138,6 +261,11 @@ async def start_bot(dev: bool) -> None:
             strip_after_prefix=True,
             tree_cls=CritTree,
         ) as bot:
+            # systemctl stop/restart sends SIGTERM and closing the terminal SIGHUP, close the bot cleanly
+            # so it saves what it only saves on close (players, command usage)
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGHUP):
+                loop.add_signal_handler(sig, lambda: loop.create_task(bot.close()))
             await bot.start(data["discord_token"], reconnect=True)
 
 
@@ -179,7 +307,6 @@ class Lavalink:
                 stdout=subprocess.DEVNULL,
                 stderr=subprocess.STDOUT,
             )
-            sleep(2.5)  # Make sure Lavalink has time to start up
 
         data["lavalink"]["path"] = self.path
         data["lavalink"]["ip"] = self.ip if self.ip else self.default_lavalink_ip
@@ -187,6 +314,46 @@ class Lavalink:
             self.port if self.port else self.default_lavalink_port
         )
 
+    async def wait_until_ready(
+        self, timeout: float = 60.0, max_delay: float = 2.0
+    ) -> bool:
+        """Poll Lavalink's version endpoint until it answers, waiting longer between each try.
+
+        A warm Lavalink answers on the first try while a cold JVM can take several seconds.
+
+        Args:
+            timeout (float, optional): Seconds to keep trying. Defaults to 60.
+            max_delay (float, optional): The longest wait between two tries in seconds. Defaults to 2.
+
+        Returns:
+            bool: Whether Lavalink answered before the deadline.
+        """
+        uri = data["lavalink"]["ip"] + ":" + data["lavalink"]["port"]
+        if "://" not in uri:
+            uri = "http://" + uri
+        headers = {"Authorization": data["lavalink"]["password"]}
+
+        deadline = time.monotonic() + timeout
+        delay = 0.1
+        async with ClientSession(timeout=ClientTimeout(total=max_delay)) as session:
+            while True:
+                try:
+                    async with session.get(f"{uri}/version", headers=headers) as resp:
+                        if resp.status == 200:
+                            return True
+                except (ClientError, asyncio.TimeoutError):
+                    pass
+
+                if lavalink_proc is not None and lavalink_proc.poll() is not None:
+                    print(f"Lavalink exited with code {lavalink_proc.returncode}")
+                    return False
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, max_delay)
+
 
 def arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="The launcher for the bot.")
@@ -224,7 +391,9 @@ async def main(args: ArgumentParser) -> None:
         print("Starting Lavalink...")
     lavalink = Lavalink(args.lavalink, args.path)
     lavalink.start_lavalink()
-    await start_bot(args.dev)
+    # the bot initializes while Lavalink starts, it only waits for it right before connecting
+    lavalink_ready = asyncio.create_task(lavalink.wait_until_ready())
+    await start_bot(args.dev, lavalink_ready)
 
 
 if __name__ == "__main__":
@@ -235,6 +404,8 @@ if __name__ == "__main__":
         print("\nInterrupted by user.")
         exit(0)
     finally:
+        # so the players of a bot that started its own Lavalink can't be resumed across restarts, they're replayed
+        # from their saved state instead. Run Lavalink separately (-l) to keep them playing through a restart.
         if lavalink_proc:
             print("\nKilling Lavalink...")
             lavalink_proc.terminate()
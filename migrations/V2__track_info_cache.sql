@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS track_info_cache(
+    source VARCHAR(32),
+    identifier TEXT,
+    info JSONB NOT NULL,
+    fetched_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY(source, identifier)
+);
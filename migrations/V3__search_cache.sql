@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS search_cache(
+    identifier TEXT PRIMARY KEY,
+    response JSONB NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
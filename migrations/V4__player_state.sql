@@ -0,0 +1,20 @@
+CREATE TABLE IF NOT EXISTS player_state(
+    guild_id BIGINT PRIMARY KEY,
+    voice_channel_id BIGINT NOT NULL,
+    text_channel_id BIGINT NOT NULL,
+    message_id BIGINT NOT NULL,
+    node TEXT NOT NULL,
+    current TEXT,
+    position INTEGER NOT NULL DEFAULT 0,
+    paused BOOLEAN NOT NULL DEFAULT FALSE,
+    volume INTEGER NOT NULL DEFAULT 100,
+    filters JSONB NOT NULL DEFAULT '{}',
+    autoplay SMALLINT NOT NULL,
+    queue_mode SMALLINT NOT NULL,
+    queue TEXT[] NOT NULL DEFAULT '{}'
+);
+
+CREATE TABLE IF NOT EXISTS lavalink_sessions(
+    node TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL
+);
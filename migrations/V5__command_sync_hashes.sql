@@ -0,0 +1,5 @@
+CREATE TABLE IF NOT EXISTS command_sync_hashes(
+    scope BIGINT PRIMARY KEY, -- 0 for the global commands, the guild id otherwise
+    hash TEXT NOT NULL,
+    synced_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
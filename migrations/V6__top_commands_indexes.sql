@@ -0,0 +1,3 @@
+-- the leaderboards of the top_cmds command are read straight from these
+CREATE INDEX IF NOT EXISTS commands_number_idx ON commands (number DESC);
+CREATE INDEX IF NOT EXISTS top_commands_guild_usage_idx ON top_commands (guild_id, usage_count DESC);